@@ -0,0 +1,157 @@
+import fcntl
+import hashlib
+import json
+import os
+import tempfile
+import threading
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from functools import lru_cache
+from pathlib import Path
+
+MANIFEST_NAME = "cache_manifest.json"
+MANIFEST_LOCK_NAME = "cache_manifest.lock"
+
+# Serializes the updates of the threads of this process (parallel loading).
+# The file lock does the same between the processes of precompute.
+_update_lock = threading.Lock()
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+@lru_cache(maxsize=256)
+def _content_hash(path: Path, size: int, mtime_ns: int) -> str:
+    # Keyed on size and mtime, inputs shared by several caches are read once
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, "rb") as f:
+        while block := f.read(HASH_BLOCK_SIZE):
+            digest.update(block)
+
+    return digest.hexdigest()
+
+
+def content_hash(path: Path) -> str:
+    """blake2b of the whole file."""
+    stat = path.stat()
+    return _content_hash(path, stat.st_size, stat.st_mtime_ns)
+
+
+@dataclass(frozen=True)
+class FileFingerprint:
+    size: int
+    mtime_ns: int
+    content_hash: str
+
+    @classmethod
+    def from_path(cls, path: Path) -> "FileFingerprint":
+        stat = path.stat()
+        return cls(stat.st_size, stat.st_mtime_ns, content_hash(path))
+
+
+class CacheManifest:
+    """
+    Records which inputs every cache file in `runtime_path` was built from
+    (cache_manifest.json). A cache is fresh when its schema version matches and
+    all its inputs have the recorded fingerprint.
+
+    Inputs with unchanged size and mtime are trusted without reading them, so
+    warm starts only stat the files. If the mtime changed (e.g. the file was
+    copied), the hash of the whole file decides.
+    """
+
+    def __init__(self, runtime_path: Path):
+        self.path = runtime_path / MANIFEST_NAME
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _write(self, entries: dict):
+        # Own temporary file per write, renamed over the manifest
+        with tempfile.NamedTemporaryFile(
+            "w", dir=self.path.parent, suffix=".tmp", delete=False
+        ) as f:
+            json.dump(entries, f, indent=1)
+        os.chmod(f.name, 0o644)  # temporary files are only readable by the owner
+        os.replace(f.name, self.path)
+
+    @contextmanager
+    def _locked(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with _update_lock, open(self.path.parent / MANIFEST_LOCK_NAME, "w") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)  # released when the file is closed
+            yield
+
+    def is_fresh(
+        self, cache_name: str, sources: list[Path], schema_version: int
+    ) -> bool:
+        entry = self._read().get(cache_name)
+        if entry is None or entry["schema_version"] != schema_version:
+            return False
+
+        recorded = entry["sources"]
+        if set(recorded) != {str(p) for p in sources}:
+            return False
+
+        touched = False
+        for source in sources:
+            try:
+                expected = FileFingerprint(**recorded[str(source)])
+            except TypeError:  # recorded by an older version of the manifest
+                return False
+            try:
+                stat = source.stat()
+            except FileNotFoundError:
+                return False
+
+            if stat.st_size != expected.size:
+                return False
+            if stat.st_mtime_ns == expected.mtime_ns:
+                continue
+            if content_hash(source) != expected.content_hash:
+                return False
+            # Same content, new mtime: remember it to skip hashing next time
+            recorded[str(source)]["mtime_ns"] = stat.st_mtime_ns
+            touched = True
+
+        if touched:
+            self._update(cache_name, entry)
+        return True
+
+    def record(
+        self,
+        cache_name: str,
+        sources: list[Path],
+        schema_version: int,
+        digests: dict[str, str] | None = None,
+    ):
+        """
+        Store the fingerprints of `sources` after (re)building a cache.
+        `digests` (optional) identify the parts of the inputs the cache was
+        built from, so a stale cache can be partly rebuilt.
+        """
+        entry: dict = {
+            "schema_version": schema_version,
+            "sources": {str(p): asdict(FileFingerprint.from_path(p)) for p in sources},
+        }
+        if digests is not None:
+            entry["digests"] = digests
+        self._update(cache_name, entry)
+
+    def recorded_digests(
+        self, cache_name: str, schema_version: int
+    ) -> dict[str, str] | None:
+        entry = self._read().get(cache_name)
+        if entry is None or entry["schema_version"] != schema_version:
+            return None
+        return entry.get("digests")
+
+    def _update(self, cache_name: str, entry: dict):
+        # Re-read under the lock so entries written by other managers are kept
+        with self._locked():
+            entries = self._read()
+            entries[cache_name] = entry
+            self._write(entries)
@@ -0,0 +1,142 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from ClusterStore import as_records
+from QuadrantInformation import QuadrantsInformation
+
+
+@dataclass(frozen=True)
+class LesionHit:
+    region: QuadrantsInformation
+    disease: str
+    position: int  # index in dict_clusters[region][disease]
+    centroid_vox: np.ndarray
+    voxel_count: int
+    distance_mm: float  # from the query point to the centroid
+
+
+class ClusterIndex:
+    """
+    KD-tree over the centroids (world coordinates, mm) of every cluster in all
+    regions and diseases. Each cluster also has an extent: the distance from
+    its centroid to the farthest corner of its bounding box, so range queries
+    return lesions reaching into the query ball, not only centered in it.
+    """
+
+    def __init__(self, dict_clusters, spacing: np.ndarray, origin: np.ndarray):
+        self.spacing = np.asarray(spacing, dtype=float)
+        self.origin = np.asarray(origin, dtype=float)
+
+        self.keys: list[tuple[QuadrantsInformation, str, int]] = []
+        diseases: list[str] = []
+        tables: list[np.ndarray] = [as_records([])]
+        for region, disease_clusters in dict_clusters.items():
+            for disease, clusters in disease_clusters.items():
+                records = as_records(clusters)
+                self.keys.extend((region, disease, i) for i in range(len(records)))
+                diseases.extend([disease] * len(records))
+                tables.append(records)
+        self.diseases = np.array(diseases, dtype=object)
+
+        def column(name: str) -> np.ndarray:
+            return np.concatenate([records[name] for records in tables])
+
+        self.centroids_vox = column("centroid_vox").astype(float)
+        self.voxel_counts = column("voxel_count")
+        self.centroids_world = self.origin + self.centroids_vox * self.spacing
+        half_extent = np.maximum(
+            self.centroids_vox - column("bbox_min"),
+            column("bbox_max") - self.centroids_vox,
+        )
+        # + half a voxel: the bbox is in voxel centers
+        self.extents_mm = np.linalg.norm((half_extent + 0.5) * self.spacing, axis=1)
+        self.max_extent_mm = float(self.extents_mm.max(initial=0.0))
+        from scipy.spatial import cKDTree
+
+        self.tree = cKDTree(self.centroids_world) if self.keys else None
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def voxel_to_world(self, ijk) -> np.ndarray:
+        return self.origin + np.asarray(ijk, dtype=float) * self.spacing
+
+    def _hit(self, i: int, point: np.ndarray) -> LesionHit:
+        region, disease, position = self.keys[i]
+        return LesionHit(
+            region=region,
+            disease=disease,
+            position=position,
+            centroid_vox=self.centroids_vox[i],
+            voxel_count=int(self.voxel_counts[i]),
+            distance_mm=float(np.linalg.norm(self.centroids_world[i] - point)),
+        )
+
+    def _allowed(self, indices: np.ndarray, diseases: list[str] | None) -> np.ndarray:
+        if diseases is None:
+            return indices
+        return indices[np.isin(self.diseases[indices], diseases)]
+
+    def nearest(
+        self,
+        point_world,
+        diseases: list[str] | None = None,
+        min_distance_mm: float = 0.0,
+    ) -> LesionHit | None:
+        """
+        Lesion with the closest centroid. `min_distance_mm` skips lesions at the
+        query point, e.g. the one currently displayed.
+        """
+        if self.tree is None:
+            return None
+
+        point = np.asarray(point_world, dtype=float)
+        k = min(8, len(self))
+        while True:
+            distances, indices = self.tree.query(point, k=k)
+            indices = np.atleast_1d(indices)[np.atleast_1d(distances) > min_distance_mm]
+            indices = self._allowed(indices, diseases)  # still sorted by distance
+            if len(indices) > 0:
+                return self._hit(int(indices[0]), point)
+            if k == len(self):
+                return None
+            k = min(4 * k, len(self))
+
+    def within_indices(
+        self, point_world, radius_mm: float, diseases: list[str] | None = None
+    ) -> np.ndarray:
+        """Positions in the index of the lesions reaching within `radius_mm`."""
+        if self.tree is None:
+            return np.zeros(0, dtype=int)
+
+        point = np.asarray(point_world, dtype=float)
+        candidates = np.asarray(
+            self.tree.query_ball_point(point, radius_mm + self.max_extent_mm),
+            dtype=int,
+        )
+        distances = np.linalg.norm(self.centroids_world[candidates] - point, axis=1)
+        reaching = candidates[distances - self.extents_mm[candidates] <= radius_mm]
+        return self._allowed(reaching, diseases)
+
+    def within(
+        self, point_world, radius_mm: float, diseases: list[str] | None = None
+    ) -> list[LesionHit]:
+        """Lesions whose extent reaches within `radius_mm`, closest first."""
+        point = np.asarray(point_world, dtype=float)
+        indices = self.within_indices(point, radius_mm, diseases)
+        distances = np.linalg.norm(self.centroids_world[indices] - point, axis=1)
+        return [self._hit(int(i), point) for i in indices[np.argsort(distances)]]
+
+    def largest_near(
+        self,
+        point_world,
+        k: int,
+        radius_mm: float,
+        diseases: list[str] | None = None,
+    ) -> list[LesionHit]:
+        """The `k` largest lesions (voxel count) within `radius_mm`."""
+        point = np.asarray(point_world, dtype=float)
+        indices = self.within_indices(point, radius_mm, diseases)
+        largest = indices[np.argsort(-self.voxel_counts[indices], kind="stable")[:k]]
+        return [self._hit(int(i), point) for i in largest]
@@ -0,0 +1,473 @@
+from collections.abc import Sequence
+from dataclasses import dataclass
+
+import numpy as np
+
+from CroppedMask import CroppedMask, crop_to_bbox
+
+## scipy is imported inside the functions that use it: warm starts read the
+## clusters from the store and never need it
+
+# Slices of the label image processed at once by cluster_statistics
+STATS_CHUNK_SLICES = 16
+
+
+@dataclass
+class ClusterInfo:
+    cluster_id: int
+    centroid_vox: np.ndarray
+    radius_vox: float
+    voxel_count: int
+    bbox_vox: tuple[np.ndarray, np.ndarray] | None = None  # (min, max inclusive)
+    # region_map mode: voxels of the whole lesion in each region, keyed by region id
+    region_voxel_counts: dict[int, int] | None = None
+    # Minimum enclosing sphere radius, only computed on request
+    enclosing_radius_vox: float | None = None
+
+
+class ClusterScratch:
+    """
+    Work buffers of compute_target, reused across the (region, disease) loop.
+    Buffers only grow, so after the largest box no more memory is allocated.
+    """
+
+    def __init__(self):
+        self._mask = np.empty(0, dtype=bool)
+        self._labels = np.empty(0, dtype=np.int32)
+
+    def mask_buffer(self, shape: tuple[int, ...]) -> np.ndarray:
+        self._mask = self._grow(self._mask, shape)
+        return self._mask[: np.prod(shape)].reshape(shape)
+
+    def label_buffer(self, shape: tuple[int, ...]) -> np.ndarray:
+        self._labels = self._grow(self._labels, shape)
+        return self._labels[: np.prod(shape)].reshape(shape)
+
+    @staticmethod
+    def _grow(buffer: np.ndarray, shape: tuple[int, ...]) -> np.ndarray:
+        size = int(np.prod(shape))
+        if buffer.size < size:
+            return np.empty(size, dtype=buffer.dtype)
+        return buffer
+
+
+def compute_target(
+    disease_mask: CroppedMask,
+    region_mask: CroppedMask,
+    scratch: "ClusterScratch | None" = None,
+    enclosing_sphere: bool = False,
+) -> list[ClusterInfo]:
+    """
+    Computes disease cluster within each region. Returns sorted list of clusters by size.
+    Only the intersection of both bounding boxes is labeled; coordinates are
+    mapped back to the full volume.
+    """
+    box = intersect_boxes(disease_mask, region_mask)
+    if box is None:
+        return []
+    box_min, box_max = box
+
+    if scratch is None:
+        scratch = ClusterScratch()
+    shape = tuple(int(n) for n in box_max - box_min + 1)
+    result_masked = scratch.mask_buffer(shape)
+    np.logical_and(
+        disease_mask.data[local_slices(box_min, box_max, disease_mask.offset)],
+        region_mask.data[local_slices(box_min, box_max, region_mask.offset)],
+        out=result_masked,
+    )
+
+    from scipy import ndimage
+
+    structure = ndimage.generate_binary_structure(3, 2)  # 26-connectivity
+    labeled = scratch.label_buffer(shape)
+    n = ndimage.label(result_masked, structure, output=labeled)
+
+    clusters = cluster_statistics(
+        labeled, n, offset=box_min, enclosing_sphere=enclosing_sphere
+    )
+    sorted_clusters = sorted(clusters, key=lambda c: c.radius_vox, reverse=True)
+
+    return sorted_clusters
+
+
+def update_target(
+    old_clusters: Sequence[ClusterInfo],
+    old_disease: CroppedMask,
+    old_region: CroppedMask,
+    disease_mask: CroppedMask,
+    region_mask: CroppedMask,
+    enclosing_sphere: bool = False,
+) -> list[ClusterInfo]:
+    """
+    Same result as compute_target(disease_mask, region_mask) given the clusters
+    of the old masks, relabeling only around the voxels that changed.
+
+    With B the box of changed voxels grown by one voxel (26-connectivity), old
+    clusters whose box misses B are unchanged. Components that touch B lie
+    within B plus the boxes of the old clusters that touch B, so that box is
+    relabeled and its components whose box meets B replace those clusters.
+    Kept clusters keep their id, new ones get ids above the old ones.
+    """
+    boxes = [
+        box
+        for box in (
+            intersect_boxes(old_disease, old_region),
+            intersect_boxes(disease_mask, region_mask),
+        )
+        if box is not None
+    ]
+    if not boxes:
+        return []
+    union_min = np.min([box[0] for box in boxes], axis=0)
+    union_max = np.max([box[1] for box in boxes], axis=0)
+
+    old_product = old_disease.crop(union_min, union_max) & old_region.crop(
+        union_min, union_max
+    )
+    new_product = disease_mask.crop(union_min, union_max) & region_mask.crop(
+        union_min, union_max
+    )
+    changed, changed_offset = crop_to_bbox(old_product ^ new_product)
+    if changed.size == 0:
+        return list(old_clusters)
+
+    changed_min = np.maximum(union_min + changed_offset - 1, union_min)
+    changed_max = np.minimum(
+        union_min + changed_offset + np.array(changed.shape), union_max
+    )
+
+    def touches_change(box_min, box_max) -> bool:
+        return bool(np.all(box_min <= changed_max) and np.all(box_max >= changed_min))
+
+    kept, stale = [], []
+    for cluster in old_clusters:
+        assert cluster.bbox_vox is not None, "Clusters without bounding box"
+        (stale if touches_change(*cluster.bbox_vox) else kept).append(cluster)
+
+    relabel_min = np.min([changed_min] + [c.bbox_vox[0] for c in stale], axis=0)
+    relabel_max = np.max([changed_max] + [c.bbox_vox[1] for c in stale], axis=0)
+    relabel = local_slices(relabel_min, relabel_max, union_min)
+
+    from scipy import ndimage
+
+    structure = ndimage.generate_binary_structure(3, 2)  # 26-connectivity
+    labeled, n = ndimage.label(new_product[relabel], structure)  # type: ignore
+    found = cluster_statistics(labeled, n, relabel_min, enclosing_sphere)
+
+    next_id = max((c.cluster_id for c in old_clusters), default=0) + 1
+    for cluster in found:
+        if touches_change(*cluster.bbox_vox):  # type: ignore
+            cluster.cluster_id = next_id
+            next_id += 1
+            kept.append(cluster)
+
+    return sorted(kept, key=lambda c: c.radius_vox, reverse=True)
+
+
+def intersect_boxes(
+    a: CroppedMask, b: CroppedMask
+) -> tuple[np.ndarray, np.ndarray] | None:
+    """Intersection (min, max inclusive) of the bounding boxes of two masks."""
+    if a.empty or b.empty:
+        return None
+
+    box_min = np.maximum(a.bbox[0], b.bbox[0])
+    box_max = np.minimum(a.bbox[1], b.bbox[1])
+    if np.any(box_max < box_min):
+        return None
+    return box_min, box_max
+
+
+def local_slices(
+    box_min: np.ndarray, box_max: np.ndarray, offset: np.ndarray
+) -> tuple[slice, ...]:
+    """Slices of the box (min, max inclusive) in an array starting at `offset`."""
+    return tuple(
+        slice(lo - o, hi - o + 1) for lo, hi, o in zip(box_min, box_max, offset)
+    )
+
+
+def surface_voxels(labeled: np.ndarray) -> np.ndarray:
+    """
+    Labeled voxels with at least one face neighbour (6-connectivity) outside
+    their label, voxels on the array border included.
+    """
+    interior = labeled != 0
+    for axis in range(labeled.ndim):
+        lo = [slice(None)] * labeled.ndim
+        hi = [slice(None)] * labeled.ndim
+        lo[axis], hi[axis] = slice(None, -1), slice(1, None)
+        same = labeled[tuple(lo)] == labeled[tuple(hi)]
+        interior[tuple(lo)] &= same
+        interior[tuple(hi)] &= same
+        edge = [slice(None)] * labeled.ndim
+        for border in (0, -1):
+            edge[axis] = border  # type: ignore
+            interior[tuple(edge)] = False
+
+    return (labeled != 0) & ~interior
+
+
+def group_statistics(
+    coords: tuple[np.ndarray, ...], groups: np.ndarray, n_groups: int
+) -> tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Voxel count, centroid and bounding box (min, max) of voxel groups.
+    `coords` are the voxel coordinates per axis and `groups` the group index
+    (0..n_groups-1) of every voxel. All groups are computed together.
+    """
+    counts = np.bincount(groups, minlength=n_groups)
+    centroids = np.empty((n_groups, 3))
+    bbox_min = np.full((n_groups, 3), np.iinfo(np.int64).max)
+    bbox_max = np.full((n_groups, 3), -1)
+    for axis, axis_coords in enumerate(coords):
+        centroids[:, axis] = np.bincount(
+            groups, weights=axis_coords, minlength=n_groups
+        )
+        np.minimum.at(bbox_min[:, axis], groups, axis_coords)
+        np.maximum.at(bbox_max[:, axis], groups, axis_coords)
+    centroids /= np.maximum(counts, 1)[:, np.newaxis]
+
+    return counts, centroids, bbox_min, bbox_max
+
+
+def group_radii(
+    coords: tuple[np.ndarray, ...],
+    groups: np.ndarray,
+    centroids: np.ndarray,
+    n_groups: int,
+) -> np.ndarray:
+    """
+    Largest distance from the group centroid to the given voxels. Passing only
+    the surface voxels gives the same result as passing all of them: an
+    interior voxel always has a face neighbour further away from any point.
+    """
+    dist_sq = np.zeros(groups.shape)
+    for axis, axis_coords in enumerate(coords):
+        dist_sq += (axis_coords - centroids[groups, axis]) ** 2
+    max_dist_sq = np.zeros(n_groups)
+    np.maximum.at(max_dist_sq, groups, dist_sq)
+
+    return np.sqrt(max_dist_sq)
+
+
+def minimum_enclosing_sphere(points: np.ndarray) -> tuple[np.ndarray, float]:
+    """
+    Smallest sphere containing `points` (N, 3), with Welzl's randomized
+    incremental algorithm. Only the convex hull vertices are used, since they
+    define the sphere.
+    """
+    from scipy.spatial import ConvexHull, QhullError
+
+    points = np.unique(np.asarray(points, dtype=float), axis=0)
+    if len(points) > 4:
+        try:
+            points = points[ConvexHull(points).vertices]
+        except QhullError:  # flat or collinear cluster, use all the points
+            pass
+    points = np.random.default_rng(0).permutation(points)
+
+    def outside(p, center, radius) -> bool:
+        return np.sum((p - center) ** 2) > radius**2 * (1 + 1e-12) + 1e-12
+
+    center, radius = points[0], 0.0
+    for i in range(1, len(points)):
+        if not outside(points[i], center, radius):
+            continue
+        center, radius = points[i], 0.0
+        for j in range(i):
+            if not outside(points[j], center, radius):
+                continue
+            center, radius = _sphere_through(points[[i, j]])
+            for k in range(j):
+                if not outside(points[k], center, radius):
+                    continue
+                center, radius = _sphere_through(points[[i, j, k]])
+                for m in range(k):
+                    if outside(points[m], center, radius):
+                        center, radius = _sphere_through(points[[i, j, k, m]])
+
+    # Degenerate support sets are solved in the least squares sense
+    radius = float(np.sqrt(np.max(np.sum((points - center) ** 2, axis=1))))
+    return center, radius
+
+
+def _sphere_through(support: np.ndarray) -> tuple[np.ndarray, float]:
+    """Smallest sphere with the 2-4 `support` points on its surface."""
+    base = support[0]
+    edges = support[1:] - base
+    # center = base + edges.T @ coef, equidistant to all support points
+    rhs = 0.5 * np.sum(edges**2, axis=1)
+    coef = np.linalg.lstsq(edges @ edges.T, rhs, rcond=None)[0]
+    center = base + edges.T @ coef
+    return center, float(np.sqrt(np.sum((support[0] - center) ** 2)))
+
+
+def enclosing_radii(
+    coords: tuple[np.ndarray, ...], groups: np.ndarray, n_groups: int
+) -> np.ndarray:
+    """Minimum enclosing sphere radius of each group of (surface) voxels."""
+    points = np.stack(coords, axis=1)
+    order = np.argsort(groups, kind="stable")
+    splits = np.cumsum(np.bincount(groups, minlength=n_groups))[:-1]
+    return np.array(
+        [minimum_enclosing_sphere(p)[1] for p in np.split(points[order], splits)]
+    )
+
+
+def cluster_statistics(
+    labeled: np.ndarray,
+    n: int,
+    offset: np.ndarray | None = None,
+    enclosing_sphere: bool = False,
+) -> list[ClusterInfo]:
+    """
+    Centroid, voxel count, bounding box and radius of every labeled component,
+    computed together from a single streamed pass over the labeled voxels
+    instead of one full volume scan per component. Matches the per-component definitions:
+    centroid is the mean voxel coordinate and radius the largest distance from
+    the centroid to a voxel of the component (only surface voxels are
+    checked). `offset` maps the coordinates of a cropped `labeled` array back
+    to the full volume. With `enclosing_sphere`, the minimum enclosing sphere
+    radius is computed too.
+    """
+    from scipy import ndimage
+
+    if n == 0:
+        return []
+
+    if offset is None:
+        offset = np.zeros(3, dtype=int)
+
+    ## Streamed over slabs along the first axis: only the coordinates of one
+    ## slab and the surface voxels are held in memory. Coordinate sums are
+    ## integers, so they are exact whatever the summation order.
+    counts = np.zeros(n + 1, dtype=np.int64)
+    sums = np.zeros((n + 1, 3))
+    surface_parts: list[tuple[tuple[np.ndarray, ...], np.ndarray]] = []
+    n_slices = labeled.shape[0]
+    for start in range(0, n_slices, STATS_CHUNK_SLICES):
+        stop = min(start + STATS_CHUNK_SLICES, n_slices)
+        slab = labeled[start:stop]
+        coords = np.nonzero(slab)
+        labels = slab[coords]
+        counts += np.bincount(labels, minlength=n + 1)
+        for axis, axis_coords in enumerate(coords):
+            shift = offset[axis] + (start if axis == 0 else 0)
+            sums[:, axis] += np.bincount(
+                labels, weights=axis_coords + shift, minlength=n + 1
+            )
+
+        # One extra slice on each side so the slab faces see their neighbours
+        lo, hi = max(start - 1, 0), min(stop + 1, n_slices)
+        surface = surface_voxels(labeled[lo:hi])[start - lo : stop - lo]
+        surface_coords = np.nonzero(surface)
+        surface_parts.append(
+            (
+                tuple(
+                    c + o + (start if axis == 0 else 0)
+                    for axis, (c, o) in enumerate(zip(surface_coords, offset))
+                ),
+                slab[surface_coords] - 1,
+            )
+        )
+
+    counts = counts[1:]
+    centroids = sums[1:] / np.maximum(counts, 1)[:, np.newaxis]
+
+    bbox_min = np.zeros((n, 3), dtype=int)
+    bbox_max = np.zeros((n, 3), dtype=int)
+    for idx, box in enumerate(ndimage.find_objects(labeled, max_label=n)):
+        if box is not None:
+            bbox_min[idx] = [sl.start for sl in box] + offset
+            bbox_max[idx] = [sl.stop - 1 for sl in box] + offset
+
+    surface = tuple(
+        np.concatenate([part[0][axis] for part in surface_parts]) for axis in range(3)
+    )
+    surface_groups = np.concatenate([part[1] for part in surface_parts])
+    radii = group_radii(surface, surface_groups, centroids, n)
+    enclosing = (
+        enclosing_radii(surface, surface_groups, n) if enclosing_sphere else None
+    )
+
+    clusters: list[ClusterInfo] = []
+    for idx in range(1, n + 1):
+        clusters.append(
+            ClusterInfo(
+                cluster_id=idx,
+                centroid_vox=centroids[idx - 1],
+                radius_vox=radii[idx - 1],
+                voxel_count=int(counts[idx - 1]),
+                bbox_vox=(bbox_min[idx - 1], bbox_max[idx - 1]),
+                enclosing_radius_vox=(
+                    None if enclosing is None else float(enclosing[idx - 1])
+                ),
+            )
+        )
+
+    return clusters
+
+
+def region_fragment_statistics(
+    labeled: np.ndarray,
+    region_ids: np.ndarray,
+    offset: np.ndarray,
+    enclosing_sphere: bool = False,
+) -> dict[int, list[ClusterInfo]]:
+    """
+    Split the labeled components by region id and compute the statistics of
+    every (component, region) fragment in one pass. Returns the fragments per
+    region id. Each fragment keeps the id of its component and the number of
+    voxels of the whole component in every region (`region_voxel_counts`).
+    """
+    inside = (labeled != 0) & (region_ids != 0)  # outside every region: ignored
+    if not inside.any():
+        return {}
+
+    # Fragment key image: component label and region id of every voxel
+    n_region_ids = int(region_ids.max()) + 1
+    fragment_keys = np.zeros(labeled.shape, dtype=np.int64)
+    fragment_keys[inside] = (
+        labeled[inside].astype(np.int64) * n_region_ids + region_ids[inside]
+    )
+
+    voxels = np.nonzero(fragment_keys)
+    keys, groups = np.unique(fragment_keys[voxels], return_inverse=True)
+    groups = groups.ravel()
+    coords = tuple(c + o for c, o in zip(voxels, offset))
+    counts, centroids, bbox_min, bbox_max = group_statistics(coords, groups, len(keys))
+
+    surface = np.nonzero(surface_voxels(fragment_keys))
+    surface_groups = np.searchsorted(keys, fragment_keys[surface])
+    surface = tuple(c + o for c, o in zip(surface, offset))
+    radii = group_radii(surface, surface_groups, centroids, len(keys))
+    enclosing = (
+        enclosing_radii(surface, surface_groups, len(keys))
+        if enclosing_sphere
+        else None
+    )
+
+    fragment_labels = keys // n_region_ids
+    fragment_regions = keys % n_region_ids
+
+    overlap: dict[int, dict[int, int]] = {}
+    for label, region_id, count in zip(fragment_labels, fragment_regions, counts):
+        overlap.setdefault(int(label), {})[int(region_id)] = int(count)
+
+    fragments: dict[int, list[ClusterInfo]] = {}
+    for i, (label, region_id) in enumerate(zip(fragment_labels, fragment_regions)):
+        fragments.setdefault(int(region_id), []).append(
+            ClusterInfo(
+                cluster_id=int(label),
+                centroid_vox=centroids[i],
+                radius_vox=radii[i],
+                voxel_count=int(counts[i]),
+                bbox_vox=(bbox_min[i], bbox_max[i]),
+                region_voxel_counts=overlap[int(label)],
+                enclosing_radius_vox=None if enclosing is None else float(enclosing[i]),
+            )
+        )
+
+    return fragments
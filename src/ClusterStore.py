@@ -0,0 +1,164 @@
+import os
+from collections.abc import Iterable, Sequence
+from pathlib import Path
+
+import numpy as np
+
+from ClusterStatistics import ClusterInfo
+
+# Arrays in the .npz are named "<region short name>|<disease>"
+STORE_KEY_SEPARATOR = "|"
+
+
+def store_key(region_short_name: str, disease: str) -> str:
+    return f"{region_short_name}{STORE_KEY_SEPARATOR}{disease}"
+
+
+def cluster_dtype(n_region_ids: int = 0) -> np.dtype:
+    """
+    One record per cluster. `region_voxel_counts` (region_map mode) holds the
+    voxels of the whole lesion per region id and is left out when unused.
+    """
+    fields = [
+        ("cluster_id", np.int32),
+        ("centroid_vox", np.float64, (3,)),
+        ("radius_vox", np.float64),
+        ("voxel_count", np.int64),
+        ("bbox_min", np.int32, (3,)),
+        ("bbox_max", np.int32, (3,)),
+        ("enclosing_radius_vox", np.float64),  # NaN when not computed
+    ]
+    if n_region_ids > 0:
+        fields.append(("region_voxel_counts", np.int64, (n_region_ids,)))
+    return np.dtype(fields)
+
+
+def clusters_to_records(clusters: Sequence[ClusterInfo], dtype: np.dtype) -> np.ndarray:
+    records = np.zeros(len(clusters), dtype=dtype)
+    if len(clusters) == 0:
+        return records
+
+    records["cluster_id"] = [c.cluster_id for c in clusters]
+    records["centroid_vox"] = [c.centroid_vox for c in clusters]
+    records["radius_vox"] = [c.radius_vox for c in clusters]
+    records["voxel_count"] = [c.voxel_count for c in clusters]
+    records["enclosing_radius_vox"] = [
+        np.nan if c.enclosing_radius_vox is None else c.enclosing_radius_vox
+        for c in clusters
+    ]
+    for i, cluster in enumerate(clusters):
+        if cluster.bbox_vox is not None:
+            records["bbox_min"][i], records["bbox_max"][i] = cluster.bbox_vox
+        if "region_voxel_counts" not in dtype.names:
+            continue
+        for region_id, count in (cluster.region_voxel_counts or {}).items():
+            records["region_voxel_counts"][i, region_id] = count
+
+    return records
+
+
+class ClusterTable(Sequence[ClusterInfo]):
+    """
+    Clusters of one (region, disease) pair, stored as a structured array (one
+    column per ClusterInfo field). The array is read from the store on first
+    use and ClusterInfo objects are only built for the clusters accessed.
+    Columns can be used directly, e.g. `table.records["radius_vox"]`.
+    """
+
+    def __init__(self, npz: np.lib.npyio.NpzFile | None, key: str):
+        self._npz = npz
+        self.key = key
+        self._records: np.ndarray | None = None
+
+    @property
+    def records(self) -> np.ndarray:
+        if self._records is None:
+            if self._npz is None or self.key not in self._npz.files:
+                self._records = np.zeros(0, dtype=cluster_dtype())
+            else:
+                self._records = self._npz[self.key]
+        return self._records
+
+    def __len__(self) -> int:
+        return len(self.records)
+
+    def __getitem__(self, index):  # type: ignore[override]
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return self._cluster(self.records[index])
+
+    def _cluster(self, record) -> ClusterInfo:
+        region_voxel_counts = None
+        if "region_voxel_counts" in record.dtype.names:
+            counts = record["region_voxel_counts"]
+            region_voxel_counts = {
+                int(i): int(counts[i]) for i in np.flatnonzero(counts)
+            }
+
+        return ClusterInfo(
+            cluster_id=int(record["cluster_id"]),
+            centroid_vox=np.array(record["centroid_vox"]),
+            radius_vox=float(record["radius_vox"]),
+            voxel_count=int(record["voxel_count"]),
+            bbox_vox=(np.array(record["bbox_min"]), np.array(record["bbox_max"])),
+            region_voxel_counts=region_voxel_counts or None,
+            enclosing_radius_vox=(
+                None
+                if np.isnan(record["enclosing_radius_vox"])
+                else float(record["enclosing_radius_vox"])
+            ),
+        )
+
+
+def as_records(clusters: Sequence[ClusterInfo]) -> np.ndarray:
+    """Structured array of the clusters, without copying ClusterTables."""
+    if isinstance(clusters, ClusterTable):
+        return clusters.records
+    return clusters_to_records(clusters, cluster_dtype())
+
+
+def save_cluster_store(path: Path, dict_clusters) -> None:
+    """
+    dict_clusters: dict[QuadrantsInformation, dict[str, Sequence[ClusterInfo]]].
+    Stored as an uncompressed .npz, regions are keyed by their short name.
+    """
+    n_region_ids = 0
+    for disease_clusters in dict_clusters.values():
+        for clusters in disease_clusters.values():
+            for cluster in clusters:
+                if cluster.region_voxel_counts:
+                    n_region_ids = max(
+                        n_region_ids, max(cluster.region_voxel_counts) + 1
+                    )
+    dtype = cluster_dtype(n_region_ids)
+
+    arrays: dict[str, np.ndarray] = {}
+    for region, disease_clusters in dict_clusters.items():
+        for disease, clusters in disease_clusters.items():
+            arrays[store_key(region.short_name, disease)] = clusters_to_records(
+                clusters, dtype
+            )
+
+    # Written aside and renamed: ClusterTables of a previous load may still
+    # read from the old file
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_suffix(".tmp")
+    with open(tmp_path, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_cluster_store(path: Path, regions: Iterable, diseases: Iterable[str]) -> dict:
+    """
+    Lazy view of a store written by save_cluster_store, with the same layout as
+    dict_clusters. Only the index of the .npz is read here.
+    """
+    npz = np.load(path, allow_pickle=False)
+    diseases = list(diseases)
+    return {
+        region: {
+            disease: ClusterTable(npz, store_key(region.short_name, disease))
+            for disease in diseases
+        }
+        for region in regions
+    }
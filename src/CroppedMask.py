@@ -0,0 +1,244 @@
+import hashlib
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import numpy as np
+
+if TYPE_CHECKING:  # vedo is imported on first use, it is slow to import
+    from vedo import Mesh, Volume
+
+PLANE_TO_AXIS = {"x": 0, "y": 1, "z": 2}
+
+
+def plane_slice(array: np.ndarray, plane: str, index: int) -> np.ndarray:
+    """
+    2D view of `array` at `index` along `plane`. Unlike np.take, which copies
+    arrays that are not C ordered (nrrd data is Fortran ordered), nothing is
+    copied.
+    """
+    axis = PLANE_TO_AXIS[plane]
+    return array[(slice(None),) * axis + (index,)]
+
+
+class CroppedMask:
+    """
+    Binary mask stored as its tight bounding box plus the offset of the box in
+    the full voxel grid. Mimics the parts of vedo.Volume used by the viewer
+    (`tonumpy`, `xslice/yslice/zslice`, `shape`, `bounds`) so it can be used
+    where a full size segmentation volume was used before.
+    """
+
+    def __init__(
+        self,
+        data: np.ndarray,
+        offset: np.ndarray,
+        shape: tuple[int, int, int],
+        spacing: np.ndarray,
+        origin: np.ndarray,
+        label_value: int = 1,
+    ):
+        self.data = data.astype(bool, copy=False)
+        self.offset = np.asarray(offset, dtype=int)
+        self.shape = tuple(int(s) for s in shape)
+        self.spacing = np.asarray(spacing, dtype=float)
+        self.origin = np.asarray(origin, dtype=float)
+        self.label_value = label_value
+
+    @classmethod
+    def from_array(
+        cls,
+        array: np.ndarray,
+        spacing: np.ndarray,
+        origin: np.ndarray,
+        label_value: int | None = None,
+        search_box: tuple[np.ndarray, np.ndarray] | None = None,
+    ) -> "CroppedMask":
+        """
+        Crop `array` to the bounding box of its non zero voxels (or of the voxels
+        equal to `label_value`). `search_box` (min, max inclusive) limits the
+        part of `array` that is read, e.g. the segment extent from the header.
+        """
+        box_min = np.zeros(3, dtype=int)
+        box_max = np.array(array.shape, dtype=int) - 1
+        if search_box is not None:
+            box_min = np.maximum(box_min, search_box[0])
+            box_max = np.minimum(box_max, search_box[1])
+
+        if np.any(box_max < box_min):
+            mask = np.zeros((0, 0, 0), dtype=bool)
+        else:
+            sub = array[tuple(slice(lo, hi + 1) for lo, hi in zip(box_min, box_max))]
+            mask = sub != 0 if label_value is None else sub == label_value
+
+        data, tight_offset = crop_to_bbox(mask)
+        return cls(
+            data,
+            box_min + tight_offset,
+            array.shape,
+            spacing,
+            origin,
+            label_value=1 if label_value is None else label_value,
+        )
+
+    @property
+    def empty(self) -> bool:
+        return self.data.size == 0
+
+    @property
+    def bbox(self) -> tuple[np.ndarray, np.ndarray]:
+        """Bounding box in voxels (min, max inclusive)."""
+        return self.offset, self.offset + np.array(self.data.shape) - 1
+
+    def save(self, path: Path):
+        """Bounding box bits, offset and grid of the mask (.npz)."""
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = path.with_suffix(".tmp")
+        with open(tmp_path, "wb") as f:
+            np.savez(
+                f,
+                bits=np.packbits(self.data),
+                box_shape=np.array(self.data.shape, dtype=np.int64),
+                offset=self.offset,
+                shape=np.array(self.shape, dtype=np.int64),
+                spacing=self.spacing,
+                origin=self.origin,
+                label_value=self.label_value,
+            )
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Path) -> "CroppedMask":
+        with np.load(path) as f:
+            box_shape = tuple(int(s) for s in f["box_shape"])
+            bits = np.unpackbits(f["bits"], count=int(np.prod(box_shape)))
+            return cls(
+                bits.reshape(box_shape),
+                f["offset"],
+                tuple(f["shape"]),
+                f["spacing"],
+                f["origin"],
+                label_value=int(f["label_value"]),
+            )
+
+    def voxel_count(self) -> int:
+        return int(np.count_nonzero(self.data))
+
+    def same_voxels(self, other: "CroppedMask") -> bool:
+        return (
+            self.shape == other.shape
+            and np.array_equal(self.offset, other.offset)
+            and np.array_equal(self.data, other.data)
+        )
+
+    def digest(self) -> str:
+        """Hash of the voxels and of their place in the grid."""
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(np.array([*self.shape, *self.offset], dtype=np.int64).tobytes())
+        digest.update(np.array(self.data.shape, dtype=np.int64).tobytes())
+        digest.update(np.packbits(self.data).tobytes())
+        return digest.hexdigest()
+
+    def tonumpy(self, dtype=np.uint8) -> np.ndarray:
+        """Full size array with `label_value` inside the mask."""
+        full = np.zeros(self.shape, dtype=dtype)
+        if not self.empty:
+            full[self.box_slices()][self.data] = self.label_value
+        return full
+
+    def box_slices(self) -> tuple[slice, slice, slice]:
+        return tuple(
+            slice(o, o + s) for o, s in zip(self.offset, self.data.shape)
+        )  # type: ignore
+
+    def crop(self, box_min: np.ndarray, box_max: np.ndarray) -> np.ndarray:
+        """Dense bool array of the mask inside the box (min, max inclusive)."""
+        out = np.zeros(tuple(np.array(box_max) - box_min + 1), dtype=bool)
+        lo = np.maximum(box_min, self.offset)
+        hi = np.minimum(box_max, self.bbox[1])
+        if self.empty or np.any(hi < lo):
+            return out
+
+        src = tuple(slice(a - o, b - o + 1) for a, b, o in zip(lo, hi, self.offset))
+        dst = tuple(slice(a - m, b - m + 1) for a, b, m in zip(lo, hi, box_min))
+        out[dst] = self.data[src]
+        return out
+
+    def slice_array(
+        self, plane: str, index: int
+    ) -> tuple[np.ndarray, tuple[int, int]] | None:
+        """
+        Cropped 2D mask (a view) at `index` along `plane` and the offset of the
+        2D box in the full slice. Returns None if the slice does not cross the
+        mask.
+        """
+        axis = PLANE_TO_AXIS[plane]
+        local = index - self.offset[axis]
+        if self.empty or local < 0 or local >= self.data.shape[axis]:
+            return None
+
+        slice_2d = plane_slice(self.data, plane, local)
+        offset_2d = tuple(int(o) for i, o in enumerate(self.offset) if i != axis)
+        return slice_2d, offset_2d  # type: ignore
+
+    def to_volume(self) -> "Volume":
+        """vedo Volume of the bounding box, placed at its world position."""
+        from vedo import Volume
+
+        return Volume(
+            self.data.astype(np.uint8) * np.uint8(self.label_value),
+            spacing=self.spacing,
+            origin=self.index_to_world(self.offset),
+        )
+
+    def _slice(self, plane: str, index: int) -> "Mesh":
+        from vedo import Mesh
+
+        axis = PLANE_TO_AXIS[plane]
+        local = index - self.offset[axis]
+        if self.empty or local < 0 or local >= self.data.shape[axis]:
+            return Mesh()
+
+        volume = self.to_volume()
+        if plane == "x":
+            return volume.xslice(local)
+        elif plane == "y":
+            return volume.yslice(local)
+        return volume.zslice(local)
+
+    def xslice(self, index: int) -> "Mesh":
+        return self._slice("x", index)
+
+    def yslice(self, index: int) -> "Mesh":
+        return self._slice("y", index)
+
+    def zslice(self, index: int) -> "Mesh":
+        return self._slice("z", index)
+
+    def index_to_world(self, ijk) -> np.ndarray:
+        return self.origin + np.asarray(ijk, dtype=float) * self.spacing
+
+    def world_to_index(self, xyz) -> np.ndarray:
+        return (np.asarray(xyz, dtype=float) - self.origin) / self.spacing
+
+    def bounds(self) -> np.ndarray:
+        """World bounds of the full grid [xmin,xmax, ymin,ymax, zmin,zmax]."""
+        last = self.index_to_world(np.array(self.shape) - 1)
+        return np.array(
+            [self.origin[0], last[0], self.origin[1], last[1], self.origin[2], last[2]]
+        )
+
+
+def crop_to_bbox(mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Crop a bool array to the bounding box of its True voxels."""
+    box_min = np.zeros(3, dtype=int)
+    box_max = np.zeros(3, dtype=int)
+    for axis in range(3):
+        other_axes = tuple(a for a in range(3) if a != axis)
+        nonzero = np.flatnonzero(np.any(mask, axis=other_axes))
+        if nonzero.size == 0:
+            return np.zeros((0, 0, 0), dtype=bool), np.zeros(3, dtype=int)
+        box_min[axis], box_max[axis] = nonzero[0], nonzero[-1]
+
+    cropped = mask[tuple(slice(lo, hi + 1) for lo, hi in zip(box_min, box_max))]
+    return np.ascontiguousarray(cropped), box_min
@@ -1,110 +1,394 @@
-import pickle
 import time
+from collections.abc import Iterable, Sequence
 from dataclasses import dataclass, field
-from functools import wraps
+from functools import partial, wraps
 from pathlib import Path
 
+import click
+import nrrd
 import numpy as np
-from scipy import ndimage
-from vedo import Volume
 
-from QuadrantInformation import QuadrantsInformation
+from CacheManifest import CacheManifest
+from ClusterIndex import ClusterIndex
+from ClusterStatistics import (
+    ClusterInfo,
+    ClusterScratch,
+    compute_target,
+    intersect_boxes,
+    region_fragment_statistics,
+    update_target,
+)
+from ClusterStore import load_cluster_store, save_cluster_store
+from CroppedMask import CroppedMask
+from PatientFiles import DATASET_PATH, PatientFiles
+from QuadrantInformation import QuadrantsInformation, build_region_label_map
+from RuntimeCache import spacing_and_origin_from_header
 from SegmentationManager import SegmentationManager
+from SharedMaskPool import map_mask_pairs
 
+CLUSTERING_MODES = ("pairwise", "region_map")
+
+# Region masks cropped to their bounding box go to <runtime_path>/regions
+REGIONS_RUNTIME_DIR = "regions"
+# Bump when the cropped region mask file changes
+REGION_MASK_SCHEMA_VERSION = 1
+
+# Bump when ClusterInfo or the clustering changes, to rebuild cached clusters
+CLUSTERS_SCHEMA_VERSION = 3
+
+
+def mask_key(kind: str, name: str) -> str:
+    """Key of a region or disease mask in the worker pool and the digests."""
+    return f"{kind}:{name}"
 
-@dataclass
-class ClusterInfo:
-    cluster_id: int
-    centroid_vox: np.ndarray
-    radius_vox: float
-    voxel_count: int
+
+def clusters_file_name(clustering_mode: str) -> str:
+    if clustering_mode == "pairwise":
+        return "dict_clusters.npz"
+    return f"dict_clusters_{clustering_mode}.npz"
+
+
+def clusters_up_to_date(
+    runtime_path: Path, source_files: list[Path], clustering_mode: str
+) -> bool:
+    """Stat only check of the cluster store, without loading any mask."""
+    cache_name = clusters_file_name(clustering_mode)
+    return (runtime_path / cache_name).exists() and CacheManifest(
+        runtime_path
+    ).is_fresh(cache_name, source_files, CLUSTERS_SCHEMA_VERSION)
 
 
 @dataclass
 class DiseaseClusterManager:
     root_path: Path
-    regions_dict: dict[QuadrantsInformation, Volume]
-    disease_dict: dict[str, tuple[int, Volume]]
-    dict_clusters: dict[QuadrantsInformation, dict[str, list[ClusterInfo]]] = field(
+    regions_dict: dict[QuadrantsInformation, CroppedMask]
+    disease_dict: dict[str, tuple[int, CroppedMask]]
+    # pairwise: label disease * region for every (region, disease) pair
+    # region_map: label each disease once and split components by region
+    clustering_mode: str = "pairwise"
+    # Processes used by calculate_clusters in pairwise mode (1: no pool)
+    workers: int = 1
+    # Also compute the minimum enclosing sphere radius of every cluster
+    enclosing_sphere: bool = False
+    # Files the clusters are computed from (seg.nrrd and region files). Cached
+    # clusters are rebuilt when any of them changes.
+    source_files: list[Path] = field(default_factory=list)
+    # Lists after a calculation, lazy ClusterTables when loaded from the store
+    dict_clusters: dict[QuadrantsInformation, dict[str, Sequence[ClusterInfo]]] = field(
         init=False
     )
+    cluster_index: ClusterIndex | None = field(default=None, init=False)
 
     def __post_init__(self):
-        try:
+        if self.clustering_mode not in CLUSTERING_MODES:
+            raise ValueError(f"Unknown clustering mode: {self.clustering_mode}")
+        # Own copy: the caller may update its dict before calling update_inputs
+        self.regions_dict = dict(self.regions_dict)
+
+        manifest = CacheManifest(self.root_path)
+        cache_name = self.clusters_path().name
+        stored = self.clusters_path().exists()
+        if stored and manifest.is_fresh(
+            cache_name, self.source_files, CLUSTERS_SCHEMA_VERSION
+        ):
             self.dict_clusters = self.load_clusters()
-            print(
-                f"Loading existing clusters from {self.root_path / 'dict_clusters.pkl'}"
-            )
-        except FileNotFoundError:
-            print("No existing clusters found, calculating clusters.")
+            print(f"Loading existing clusters from {self.clusters_path()}")
+            return
+
+        ## Source files changed: only the pairs of the masks whose digest
+        ## changed are recomputed
+        digests = self.input_digests()
+        old_digests = (
+            manifest.recorded_digests(cache_name, CLUSTERS_SCHEMA_VERSION)
+            if stored
+            else None
+        )
+        if old_digests is None:
+            print("No up to date clusters found, calculating clusters.")
             self.dict_clusters = self.calculate_clusters()
-            self.save_clusters()
+        else:
+            self.dict_clusters = self.load_clusters()
+            changed_regions = {
+                region
+                for region in self.regions_dict
+                if digests[mask_key("region", region.short_name)]
+                != old_digests.get(mask_key("region", region.short_name))
+            }
+            changed_diseases = {
+                disease
+                for disease in self.disease_dict
+                if digests[mask_key("disease", disease)]
+                != old_digests.get(mask_key("disease", disease))
+            }
+            pairs = self.recalculate_pairs(changed_regions, changed_diseases)
+            print(f"Inputs changed, recalculated {len(pairs)} cluster pairs.")
+        self.save_clusters()
+        manifest.record(cache_name, self.source_files, CLUSTERS_SCHEMA_VERSION, digests)
 
     def calculate_clusters(
         self,
     ) -> dict[QuadrantsInformation, dict[str, list[ClusterInfo]]]:
+        if self.clustering_mode == "region_map":
+            return self.calculate_clusters_region_map()
+
+        if self.workers > 1:
+            return self.calculate_clusters_parallel()
+
+        scratch = ClusterScratch()
         dict_clusters: dict[QuadrantsInformation, dict[str, list[ClusterInfo]]] = {}
         for region, region_vol in self.regions_dict.items():
             dict_clusters[region] = {}
-            for disease, (label_value, disease_vol) in self.disease_dict.items():
+            for disease, (_, disease_vol) in self.disease_dict.items():
                 dict_clusters[region][disease] = []
 
                 clusters = self.compute_target(
-                    disease_vol.tonumpy(),
-                    region_vol.tonumpy(),
-                    label_value,
+                    disease_vol, region_vol, scratch, self.enclosing_sphere
                 )
                 dict_clusters[region][disease].extend(clusters)
 
         return dict_clusters
 
-    def load_clusters(self) -> dict[QuadrantsInformation, dict[str, list[ClusterInfo]]]:
-        with open(self.root_path / "dict_clusters.pkl", "rb") as f:
-            return pickle.load(f)
+    def calculate_clusters_parallel(
+        self,
+    ) -> dict[QuadrantsInformation, dict[str, list[ClusterInfo]]]:
+        """
+        Same result as the serial loop, with the (region, disease) pairs spread
+        over a process pool. Masks are shared with the workers through shared
+        memory; pairs whose bounding boxes do not intersect are not dispatched.
+        """
+        pair_clusters = self.compute_pairs_parallel(
+            [
+                (region, disease)
+                for region in self.regions_dict
+                for disease in self.disease_dict
+            ]
+        )
 
-    def save_clusters(self):
-        if self.root_path.exists() is False:
-            self.root_path.mkdir(parents=True, exist_ok=True)
+        dict_clusters: dict[QuadrantsInformation, dict[str, list[ClusterInfo]]] = {}
+        for region in self.regions_dict:
+            dict_clusters[region] = {
+                disease: pair_clusters[(region, disease)]
+                for disease in self.disease_dict
+            }
 
-        with open(self.root_path / "dict_clusters.pkl", "wb") as f:
-            pickle.dump(self.dict_clusters, f)
+        return dict_clusters
 
-    def compute_target(
+    def compute_pairs_parallel(
+        self, pairs: list[tuple[QuadrantsInformation, str]]
+    ) -> dict[tuple[QuadrantsInformation, str], list[ClusterInfo]]:
+        """Clusters of the (region, disease) pairs, computed in a process pool."""
+        masks: dict[str, CroppedMask] = {}
+        for region in {region for region, _ in pairs}:
+            masks[mask_key("region", region.short_name)] = self.regions_dict[region]
+        for disease in {disease for _, disease in pairs}:
+            masks[mask_key("disease", disease)] = self.disease_dict[disease][1]
+
+        dispatched = [
+            (region, disease)
+            for region, disease in pairs
+            if intersect_boxes(self.disease_dict[disease][1], self.regions_dict[region])
+            is not None
+        ]
+        results = map_mask_pairs(
+            partial(compute_target, enclosing_sphere=self.enclosing_sphere),
+            masks,
+            [
+                (mask_key("disease", disease), mask_key("region", region.short_name))
+                for region, disease in dispatched
+            ],
+            self.workers,
+            make_state=ClusterScratch,
+        )
+        pair_clusters = {pair: [] for pair in pairs}
+        pair_clusters.update(zip(dispatched, results))
+        return pair_clusters
+
+    def recalculate_pairs(
         self,
-        disease_volume: np.ndarray,
-        region_volume: np.ndarray,
-        segment_label_value: int,
-    ) -> list[ClusterInfo]:
+        changed_regions: set[QuadrantsInformation],
+        changed_diseases: set[str],
+        old_regions: dict[QuadrantsInformation, CroppedMask] | None = None,
+        old_diseases: dict[str, CroppedMask] | None = None,
+    ) -> list[tuple[QuadrantsInformation, str]]:
         """
-        Computes disease cluster within each region. Returns sorted list of clusters by size.
+        Recompute in dict_clusters the pairs with a changed region or disease
+        mask and return them. In pairwise mode, pairs whose previous masks are
+        given are updated around the changed voxels only (see update_target).
         """
+        if self.clustering_mode == "region_map":
+            # Editing a region moves the fragments of every disease
+            diseases = set(self.disease_dict) if changed_regions else changed_diseases
+            fresh = self.calculate_clusters_region_map(diseases)
+            for region in self.regions_dict:
+                self.dict_clusters.setdefault(region, {}).update(fresh[region])
+            self.cluster_index = None
+            return [(r, d) for r in self.regions_dict for d in fresh[r]]
+
+        pairs = [
+            (region, disease)
+            for region in self.regions_dict
+            for disease in self.disease_dict
+            if region in changed_regions or disease in changed_diseases
+        ]
+        old_regions = old_regions or {}
+        old_diseases = old_diseases or {}
+        incremental = [
+            (region, disease)
+            for region, disease in pairs
+            if region in old_regions and disease in old_diseases
+        ]
+        full = [pair for pair in pairs if pair not in incremental]
+
+        if self.workers > 1 and len(full) > 1:
+            recomputed = self.compute_pairs_parallel(full)
+        else:
+            scratch = ClusterScratch()
+            recomputed = {
+                (region, disease): compute_target(
+                    self.disease_dict[disease][1],
+                    self.regions_dict[region],
+                    scratch,
+                    self.enclosing_sphere,
+                )
+                for region, disease in full
+            }
+        for region, disease in incremental:
+            recomputed[(region, disease)] = update_target(
+                self.dict_clusters[region][disease],
+                old_diseases[disease],
+                old_regions[region],
+                self.disease_dict[disease][1],
+                self.regions_dict[region],
+                self.enclosing_sphere,
+            )
 
-        region_volume = region_volume.astype(bool)
-        result_masked = disease_volume * region_volume == segment_label_value
+        for (region, disease), clusters in recomputed.items():
+            self.dict_clusters.setdefault(region, {})[disease] = clusters
+        self.cluster_index = None
+        return pairs
 
+    def update_inputs(
+        self,
+        regions_dict: dict[QuadrantsInformation, CroppedMask] | None = None,
+        disease_dict: dict[str, tuple[int, CroppedMask]] | None = None,
+    ) -> list[tuple[QuadrantsInformation, str]]:
+        """
+        Swap in reloaded masks, e.g. after the annotation files were edited.
+        `regions_dict` may hold only the reloaded regions. Only the pairs of
+        changed masks are recomputed, then the store and manifest are updated.
+        Returns the recomputed pairs.
+        """
+        old_regions = dict(self.regions_dict)
+        old_diseases = {d: mask for d, (_, mask) in self.disease_dict.items()}
+        if regions_dict is not None:
+            self.regions_dict = {**self.regions_dict, **regions_dict}
+        if disease_dict is not None:
+            self.disease_dict = disease_dict
+
+        changed_regions = {
+            region
+            for region, mask in self.regions_dict.items()
+            if region not in old_regions or not mask.same_voxels(old_regions[region])
+        }
+        changed_diseases = {
+            disease
+            for disease, (_, mask) in self.disease_dict.items()
+            if disease not in old_diseases
+            or not mask.same_voxels(old_diseases[disease])
+        }
+        removed_diseases = set(old_diseases) - set(self.disease_dict)
+        for disease_clusters in self.dict_clusters.values():
+            for disease in removed_diseases:
+                disease_clusters.pop(disease, None)
+
+        pairs = self.recalculate_pairs(
+            changed_regions, changed_diseases, old_regions, old_diseases
+        )
+        if pairs or removed_diseases:
+            self.cluster_index = None
+            self.save_clusters()
+            CacheManifest(self.root_path).record(
+                self.clusters_path().name,
+                self.source_files,
+                CLUSTERS_SCHEMA_VERSION,
+                self.input_digests(),
+            )
+        return pairs
+
+    def input_digests(self) -> dict[str, str]:
+        """Digest of every region and disease mask, see CroppedMask.digest."""
+        digests = {
+            mask_key("region", region.short_name): mask.digest()
+            for region, mask in self.regions_dict.items()
+        }
+        for disease, (_, mask) in self.disease_dict.items():
+            digests[mask_key("disease", disease)] = mask.digest()
+        return digests
+
+    def calculate_clusters_region_map(
+        self, diseases: Iterable[str] | None = None
+    ) -> dict[QuadrantsInformation, dict[str, list[ClusterInfo]]]:
+        """
+        Merges the region masks into one region id volume and labels each disease
+        once (inside its bounding box). Components are split into per-region
+        fragments by the region ids of their voxels, so a lesion crossing a
+        region boundary keeps one cluster id in all the regions it touches.
+        `diseases` limits the calculation to some diseases (default: all).
+        """
+        from scipy import ndimage
+
+        if diseases is None:
+            diseases = self.disease_dict.keys()
+        diseases = [d for d in self.disease_dict if d in set(diseases)]
+
+        region_map = build_region_label_map(self.regions_dict)
         structure = ndimage.generate_binary_structure(3, 2)  # 26-connectivity
-        labeled, n = ndimage.label(result_masked, structure)  # type: ignore
-
-        clusters: list[ClusterInfo] = []
-        if n > 0:
-            for idx in range(1, n + 1):
-                coords = np.argwhere(labeled == idx)  # voxel coords (z,y,x)
-                centroid = coords.mean(axis=0)  # centroid in voxels
-                radius = np.linalg.norm(coords - centroid, axis=1).max()
-                clusters.append(
-                    ClusterInfo(
-                        cluster_id=idx,
-                        centroid_vox=centroid,
-                        radius_vox=radius,
-                        voxel_count=len(coords),
-                    )
+
+        dict_clusters: dict[QuadrantsInformation, dict[str, list[ClusterInfo]]] = {
+            region: {disease: [] for disease in diseases}
+            for region in self.regions_dict
+        }
+        for disease in diseases:
+            disease_mask = self.disease_dict[disease][1]
+            if disease_mask.empty:
+                continue
+
+            labeled, _ = ndimage.label(disease_mask.data, structure)  # type: ignore
+            fragments = region_fragment_statistics(
+                labeled,
+                region_map[disease_mask.box_slices()],
+                disease_mask.offset,
+                enclosing_sphere=self.enclosing_sphere,
+            )
+            for region_id, clusters in fragments.items():
+                region = QuadrantsInformation.from_id(region_id - 1)
+                dict_clusters[region][disease] = sorted(
+                    clusters, key=lambda c: c.radius_vox, reverse=True
                 )
 
-            sorted_clusters = sorted(clusters, key=lambda c: c.radius_vox, reverse=True)
-        else:
-            sorted_clusters = []
+        return dict_clusters
 
-        return sorted_clusters
+    def clusters_path(self) -> Path:
+        return self.root_path / clusters_file_name(self.clustering_mode)
+
+    def load_clusters(
+        self,
+    ) -> dict[QuadrantsInformation, dict[str, Sequence[ClusterInfo]]]:
+        return load_cluster_store(
+            self.clusters_path(), self.regions_dict.keys(), self.disease_dict.keys()
+        )
+
+    def save_clusters(self):
+        save_cluster_store(self.clusters_path(), self.dict_clusters)
+
+    def compute_target(
+        self,
+        disease_mask: CroppedMask,
+        region_mask: CroppedMask,
+        scratch: "ClusterScratch | None" = None,
+        enclosing_sphere: bool = False,
+    ) -> list[ClusterInfo]:
+        return compute_target(disease_mask, region_mask, scratch, enclosing_sphere)
 
     def cluster_report(self):
         for region in self.dict_clusters.keys():
@@ -117,6 +401,26 @@ class DiseaseClusterManager:
                     print(
                         f"Radius (vox): {cluster.radius_vox:.2f}, Centroid (vox): {cluster.centroid_vox}"
                     )
+                    overlap = self.region_overlap(cluster)
+                    if len(overlap) > 1:
+                        shares = ", ".join(
+                            f"{r.short_name} {share:.0%}"
+                            for r, share in overlap.items()
+                        )
+                        print(f"    Lesion {cluster.cluster_id} spans: {shares}")
+
+    def region_overlap(self, cluster: ClusterInfo) -> dict[QuadrantsInformation, float]:
+        """Fraction of the whole lesion inside each region (region_map mode)."""
+        if cluster.region_voxel_counts is None:
+            return {}
+
+        total = sum(cluster.region_voxel_counts.values())
+        return {
+            QuadrantsInformation.from_id(region_id - 1): count / total
+            for region_id, count in sorted(
+                cluster.region_voxel_counts.items(), key=lambda kv: -kv[1]
+            )
+        }
 
     def disease_prescence(self, region: QuadrantsInformation, disease: str) -> bool:
         return len(self.dict_clusters[region][disease]) > 0
@@ -130,15 +434,65 @@ class DiseaseClusterManager:
 
         return clusters[0].centroid_vox.astype(int)
 
+    def get_cluster_index(self) -> ClusterIndex:
+        """Spatial index over the clusters of all regions and diseases."""
+        if self.cluster_index is None:
+            grid = next(iter(self.regions_dict.values()))
+            self.cluster_index = ClusterIndex(
+                self.dict_clusters, grid.spacing, grid.origin
+            )
+        return self.cluster_index
+
+
+def region_mask_path(region_file: Path, runtime_path: Path) -> Path:
+    stem = region_file.name.removesuffix(".nrrd")
+    return runtime_path / REGIONS_RUNTIME_DIR / f"{stem}.mask.npz"
+
+
+def region_mask_up_to_date(region_file: Path, runtime_path: Path) -> bool:
+    path = region_mask_path(region_file, runtime_path)
+    return path.exists() and CacheManifest(path.parent).is_fresh(
+        path.name, [region_file], REGION_MASK_SCHEMA_VERSION
+    )
+
+
+def load_region_mask(
+    region_file: Path, runtime_path: Path | None = None
+) -> CroppedMask:
+    """
+    Region mask cropped to its bounding box. With `runtime_path` the cropped
+    mask is cached there, so the full size region is only read again when the
+    nrrd file changes.
+    """
+    if runtime_path is not None and region_mask_up_to_date(region_file, runtime_path):
+        return CroppedMask.load(region_mask_path(region_file, runtime_path))
+
+    data, header = nrrd.read(str(region_file))
+    if data.ndim > 3:  # multi-layer file, collapse layers
+        data = np.any(data, axis=0)
+
+    spacing, origin = spacing_and_origin_from_header(header)
+    mask = CroppedMask.from_array(data, spacing, origin)
+    if runtime_path is not None:
+        print(f"Caching the cropped mask of {region_file.name}")
+        path = region_mask_path(region_file, runtime_path)
+        mask.save(path)
+        CacheManifest(path.parent).record(
+            path.name, [region_file], REGION_MASK_SCHEMA_VERSION
+        )
+
+    return mask
+
 
 def load_ct_scans_regions(
-    data_path: Path,
-) -> dict[QuadrantsInformation, Volume]:
+    data_path: Path, runtime_path: Path | None = None
+) -> dict[QuadrantsInformation, CroppedMask]:
+    """Region masks are stored cropped to their bounding box."""
     regions_path = data_path / "regions"
-    regions_dict: dict[QuadrantsInformation, Volume] = {}
+    regions_dict: dict[QuadrantsInformation, CroppedMask] = {}
     for region_file in regions_path.glob("*.seg.nrrd"):
         quadrant_info = QuadrantsInformation.from_file_name(region_file)
-        regions_dict[quadrant_info] = Volume(region_file)
+        regions_dict[quadrant_info] = load_region_mask(region_file, runtime_path)
 
         # print(f"Loaded {quadrant_info.name}")
         # if quadrant_info == QuadrantsInformation.PELVIC_REGION:
@@ -159,25 +513,40 @@ def timeit(func):
     return wrapper
 
 
+@click.command()
+@click.option(
+    "--dataset-path",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default=DATASET_PATH,
+    show_default=True,
+)
+@click.option("--patient-id", type=int, default=6, show_default=True)
+@click.option(
+    "--clustering-mode",
+    type=click.Choice(CLUSTERING_MODES),
+    default="pairwise",
+    show_default=True,
+)
 @timeit
-def main():
+def main(dataset_path: Path, patient_id: int, clustering_mode: str):
     ## Setup
-    data_path = Path("/home/juan95/JuanData/OvarianCancerDataset/CT_scans")
-
-    patient_id = 6
-    complete_path = data_path / f"Patient{patient_id:02d}/3d_slicer/"
-    seg_path = complete_path / "radiologist_annotations.seg.nrrd"
+    patient = PatientFiles.from_dataset(dataset_path, patient_id)
+    cluster_path = patient.runtime_path
 
-    vedo_segment_loader = SegmentationManager(seg_path)
-    vedo_segment_loader.load_volumes_to_cache(["primary", "lymph node", "carcinosis"])
+    vedo_segment_loader = SegmentationManager(
+        patient.seg_path, runtime_path=cluster_path
+    )
+    vedo_segment_loader.load_volumes_to_cache(vedo_segment_loader.segment_names())
 
-    regions_dict = load_ct_scans_regions(complete_path)
+    regions_dict = load_ct_scans_regions(patient.data_path, runtime_path=cluster_path)
     disease_dict = vedo_segment_loader.get_cache_volume_dict()
 
-    cluster_path = complete_path / "interface_runtime"
-
     cluster_manager = DiseaseClusterManager(
-        regions_dict=regions_dict, disease_dict=disease_dict, root_path=cluster_path
+        regions_dict=regions_dict,
+        disease_dict=disease_dict,
+        root_path=cluster_path,
+        clustering_mode=clustering_mode,
+        source_files=[patient.seg_path, *patient.region_files],
     )
 
     cluster_manager.cluster_report()
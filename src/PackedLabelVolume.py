@@ -0,0 +1,124 @@
+import numpy as np
+
+from CroppedMask import plane_slice
+from SegmentCatalog import SegmentationNameNotFoundError, SegmentCatalog
+
+# Number of z slices converted at once. Bounds the size of the temporaries.
+PACKING_CHUNK_SLICES = 32
+
+
+def packed_dtype(n_segments: int) -> type:
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if n_segments <= np.iinfo(dtype).bits:
+            return dtype
+    raise ValueError(f"Too many segments to bit-pack: {n_segments}")
+
+
+class PackedLabelVolume:
+    """
+    Multi-label volume where each voxel stores one bit per segment. Overlapping
+    segments (stored in separate layers of the seg.nrrd) end up in the same
+    array, so slicing and membership tests for all segments need a single read.
+    """
+
+    def __init__(
+        self,
+        bits: np.ndarray,
+        segment_bits: dict[str, int],
+        spacing: np.ndarray,
+        origin: np.ndarray,
+    ):
+        self.bits = bits
+        self.segment_bits = segment_bits
+        self.spacing = np.asarray(spacing, dtype=float)
+        self.origin = np.asarray(origin, dtype=float)
+
+    @classmethod
+    def from_segmentation(
+        cls,
+        data: np.ndarray,
+        catalog: SegmentCatalog,
+        spacing: np.ndarray,
+        origin: np.ndarray,
+    ) -> "PackedLabelVolume":
+        """
+        Built in one pass over each layer: every label value is mapped to the
+        bits of the segments using it through a lookup table.
+        """
+        layers = data if data.ndim > 3 else data[np.newaxis]
+        dtype = packed_dtype(len(catalog))
+        segment_bits = {segment.name: bit for bit, segment in enumerate(catalog)}
+
+        # Per layer lookup table: label value -> bits of the segments using it
+        layer_luts: dict[int, np.ndarray] = {}
+        for segment in catalog:
+            max_label = max(s.label_value for s in catalog if s.layer == segment.layer)
+            lut = layer_luts.setdefault(
+                segment.layer, np.zeros(lut_size(layers.dtype, max_label), dtype=dtype)
+            )
+            lut[segment.label_value] |= dtype(1 << segment_bits[segment.name])
+
+        bits = np.zeros(layers.shape[1:], dtype=dtype, order="F")
+        n_slices = bits.shape[2]
+        for layer_idx, lut in layer_luts.items():
+            layer = layers[layer_idx]
+            covers_dtype = lut.size > np.iinfo(layers.dtype).max
+            for z0 in range(0, n_slices, PACKING_CHUNK_SLICES):
+                z1 = min(z0 + PACKING_CHUNK_SLICES, n_slices)
+                chunk = np.asarray(layer[:, :, z0:z1])
+                if covers_dtype:
+                    bits[:, :, z0:z1] |= lut[chunk]
+                else:  # values outside of the table belong to no segment
+                    inside = (chunk >= 0) & (chunk < lut.size)
+                    bits[:, :, z0:z1] |= np.where(inside, lut[chunk * inside], 0)
+
+        return cls(bits, segment_bits, spacing, origin)
+
+    @property
+    def shape(self) -> tuple[int, ...]:
+        return self.bits.shape
+
+    def segment_names(self) -> list[str]:
+        return list(self.segment_bits.keys())
+
+    def bit_mask(self, segment_name: str):
+        try:
+            return self.bits.dtype.type(1 << self.segment_bits[segment_name])
+        except KeyError:
+            raise SegmentationNameNotFoundError(
+                f"Label '{segment_name}' not found in packed label volume"
+            )
+
+    def slice(self, plane: str, index: int) -> np.ndarray:
+        """Packed 2D slice (a view) with the bits of every segment."""
+        return plane_slice(self.bits, plane, index)
+
+    def segment_slices(self, plane: str, index: int) -> dict[str, np.ndarray]:
+        """Bool 2D slice of every segment, from a single read of the volume."""
+        packed_slice = self.slice(plane, index)
+        return {
+            name: (packed_slice & self.bit_mask(name)) != 0
+            for name in self.segment_bits
+        }
+
+    def segment_slice(self, segment_name: str, plane: str, index: int) -> np.ndarray:
+        return (self.slice(plane, index) & self.bit_mask(segment_name)) != 0
+
+    def mask(self, segment_name: str) -> np.ndarray:
+        return (self.bits & self.bit_mask(segment_name)) != 0
+
+    def contains(self, segment_name: str, ijk) -> bool:
+        i, j, k = (int(v) for v in ijk)
+        return bool(self.bits[i, j, k] & self.bit_mask(segment_name))
+
+    def segments_at(self, ijk) -> list[str]:
+        i, j, k = (int(v) for v in ijk)
+        value = int(self.bits[i, j, k])
+        return [name for name, bit in self.segment_bits.items() if value >> bit & 1]
+
+
+def lut_size(data_dtype: np.dtype, max_label: int) -> int:
+    """Small unsigned types use a table covering every possible value."""
+    if np.issubdtype(data_dtype, np.unsignedinteger) and data_dtype.itemsize <= 2:
+        return max(np.iinfo(data_dtype).max + 1, max_label + 1)
+    return max_label + 1
@@ -0,0 +1,54 @@
+import re
+from dataclasses import dataclass
+from pathlib import Path
+
+from RuntimeCache import RUNTIME_DIR_NAME
+
+DATASET_PATH = Path("/home/juan95/JuanData/OvarianCancerDataset/CT_scans")
+
+# <dataset>/PatientXX/3d_slicer
+PATIENT_DIR_PATTERN = re.compile(r"Patient(\d+)")
+SLICER_DIR_NAME = "3d_slicer"
+
+
+@dataclass(frozen=True)
+class PatientFiles:
+    """Input files and runtime folder of one patient in the dataset tree."""
+
+    patient_id: int
+    data_path: Path  # <dataset>/PatientXX/3d_slicer
+
+    @classmethod
+    def from_dataset(cls, dataset_path: Path, patient_id: int) -> "PatientFiles":
+        data_path = dataset_path / f"Patient{patient_id:02d}" / SLICER_DIR_NAME
+        return cls(patient_id, data_path)
+
+    @property
+    def ct_path(self) -> Path:
+        return self.data_path / f"raw_scans_patient_{self.patient_id:02d}.nrrd"
+
+    @property
+    def seg_path(self) -> Path:
+        return self.data_path / "radiologist_annotations.seg.nrrd"
+
+    @property
+    def region_files(self) -> list[Path]:
+        return sorted((self.data_path / "regions").glob("*.seg.nrrd"))
+
+    @property
+    def runtime_path(self) -> Path:
+        return self.data_path / RUNTIME_DIR_NAME
+
+
+def find_patients(dataset_path: Path) -> list[PatientFiles]:
+    """Patients with a segmentation under `dataset_path`, sorted by id."""
+    patients = []
+    for patient_dir in dataset_path.iterdir():
+        match = PATIENT_DIR_PATTERN.fullmatch(patient_dir.name)
+        if match is None:
+            continue
+        patient = PatientFiles(int(match.group(1)), patient_dir / SLICER_DIR_NAME)
+        if patient.seg_path.exists():
+            patients.append(patient)
+
+    return sorted(patients, key=lambda p: p.patient_id)
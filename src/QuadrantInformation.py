@@ -1,11 +1,19 @@
-import pickle
 from enum import Enum
 from pathlib import Path
 
 import numpy as np
-import seaborn as sns
 
-regions_color_palette = sns.color_palette("Set2", 7).as_hex()
+# seaborn.color_palette("Set2", 7).as_hex(), inlined to keep seaborn (2 s to
+# import) off the startup path
+regions_color_palette = [
+    "#66c2a5",
+    "#fc8d62",
+    "#8da0cb",
+    "#e78ac3",
+    "#a6d854",
+    "#ffd92f",
+    "#e5c494",
+]
 
 
 class QuadrantsInformation(Enum):
@@ -88,42 +96,21 @@ class QuadrantsInformation(Enum):
         return self._color
 
 
-def load_centers(path: Path):
-    complete_path = path / "regions_center.pkl"
-    if not Path(complete_path).exists():
-        raise FileNotFoundError(f"Center file not found: {complete_path}")
-
-    return pickle.load(open(complete_path, "rb"))
-
-
-def save_centers(centers: dict[QuadrantsInformation, np.ndarray], runtime_path: Path):
-    path = runtime_path / "regions_center.pkl"
-    path.parent.mkdir(parents=True, exist_ok=True)
-
-    with open(path, "wb") as f:
-        pickle.dump(centers, f)
-
-
-def compute_center(volume):
-    seg_np = volume.tonumpy()
-
-    indices = np.argwhere(seg_np == 1)
-    min_idx = indices.min(axis=0)
-    max_idx = indices.max(axis=0)
-    center_idx = ((min_idx + max_idx) // 2).astype(int)
-    print(f"Center idx {center_idx}")
-
-    return center_idx
-
-    # # seg is a vedo.Volume
-    # ijk = center_idx
-
-    # # VTK has a method for this:
-    # world_coords: MutableSequence[float]
-    # world_coords = [0, 0, 0]
-    # volume.dataset.TransformContinuousIndexToPhysicalPoint(ijk, world_coords)
-
-    # return np.array(world_coords)
+def build_region_label_map(regions_dict) -> np.ndarray:
+    """
+    Merge region masks (dict[QuadrantsInformation, CroppedMask]) into a single
+    uint8 volume storing `region.id + 1` (0 is outside every region). Where
+    regions overlap, the region with the larger id wins.
+    """
+    first_mask = next(iter(regions_dict.values()))
+    label_map = np.zeros(first_mask.shape, dtype=np.uint8)
+    for region in sorted(regions_dict, key=lambda r: r.id):
+        mask = regions_dict[region]
+        if mask.empty:
+            continue
+        label_map[mask.box_slices()][mask.data] = region.id + 1
+
+    return label_map
 
 
 ## Unused
@@ -0,0 +1,149 @@
+import json
+from dataclasses import dataclass, fields
+from pathlib import Path
+
+import numpy as np
+
+from CacheManifest import CacheManifest
+from CroppedMask import CroppedMask
+from QuadrantInformation import QuadrantsInformation
+
+GEOMETRY_FILE_NAME = "regions_geometry.json"
+# Bump when RegionGeometry changes, to rebuild cached geometries
+GEOMETRY_SCHEMA_VERSION = 1
+
+# The 3D camera looks at a region from this far in front of the grid
+CAMERA_DISTANCE_MM = 200.0
+
+
+@dataclass(frozen=True)
+class RegionGeometry:
+    """
+    Geometry of one region mask, in voxels and in world coordinates (mm).
+    index 0 --> Left-right
+    index 1 --> Anterior-posterior
+    index 2 --> inferior-superior
+    """
+
+    voxel_count: int
+    bbox_min: np.ndarray  # voxels, inclusive
+    bbox_max: np.ndarray
+    center_vox: np.ndarray  # bbox midpoint
+    centroid_vox: np.ndarray  # mean voxel position
+    anterior_center_vox: np.ndarray  # center moved to the anterior grid plane
+    center_world: np.ndarray
+    centroid_world: np.ndarray
+    anterior_center_world: np.ndarray
+    camera_position_world: np.ndarray  # in front of the anterior center
+
+    @classmethod
+    def from_mask(cls, mask: CroppedMask) -> "RegionGeometry":
+        """Bbox from the crop, voxel count and centroid from two projections."""
+        if mask.empty:
+            bbox_min = bbox_max = np.zeros(3, dtype=int)
+            center_vox = np.array(mask.shape) // 2
+            centroid_vox = center_vox.astype(float)
+            voxel_count = 0
+        else:
+            bbox_min, bbox_max = mask.bbox
+            center_vox = (bbox_min + bbox_max) // 2
+            counts_xy = np.count_nonzero(mask.data, axis=2)
+            counts_z = np.count_nonzero(mask.data, axis=(0, 1))
+            voxel_count = int(counts_z.sum())
+            sums = [
+                counts_xy.sum(axis=1) @ np.arange(mask.data.shape[0], dtype=float),
+                counts_xy.sum(axis=0) @ np.arange(mask.data.shape[1], dtype=float),
+                counts_z @ np.arange(mask.data.shape[2], dtype=float),
+            ]
+            centroid_vox = mask.offset + np.array(sums) / voxel_count
+
+        anterior_center_vox = center_vox.copy()
+        anterior_center_vox[1] = mask.shape[1]
+        anterior_center_world = mask.index_to_world(anterior_center_vox)
+        camera_position_world = anterior_center_world.copy()
+        camera_position_world[1] = mask.bounds()[2] - CAMERA_DISTANCE_MM
+
+        return cls(
+            voxel_count=voxel_count,
+            bbox_min=np.asarray(bbox_min),
+            bbox_max=np.asarray(bbox_max),
+            center_vox=center_vox,
+            centroid_vox=centroid_vox,
+            anterior_center_vox=anterior_center_vox,
+            center_world=mask.index_to_world(center_vox),
+            centroid_world=mask.index_to_world(centroid_vox),
+            anterior_center_world=anterior_center_world,
+            camera_position_world=camera_position_world,
+        )
+
+    def to_dict(self) -> dict:
+        return {
+            f.name: np.asarray(getattr(self, f.name)).tolist() for f in fields(self)
+        }
+
+    @classmethod
+    def from_dict(cls, values: dict) -> "RegionGeometry":
+        return cls(
+            **{
+                name: value if name == "voxel_count" else np.array(value)
+                for name, value in values.items()
+            }
+        )
+
+
+def compute_region_geometries(
+    regions_dict: dict[QuadrantsInformation, CroppedMask],
+) -> dict[QuadrantsInformation, RegionGeometry]:
+    return {
+        region: RegionGeometry.from_mask(mask) for region, mask in regions_dict.items()
+    }
+
+
+def save_region_geometries(
+    geometries: dict[QuadrantsInformation, RegionGeometry], runtime_path: Path
+):
+    runtime_path.mkdir(parents=True, exist_ok=True)
+    with open(runtime_path / GEOMETRY_FILE_NAME, "w") as f:
+        json.dump(
+            {region.short_name: g.to_dict() for region, g in geometries.items()},
+            f,
+            indent=1,
+        )
+
+
+def load_region_geometries(
+    runtime_path: Path,
+) -> dict[QuadrantsInformation, RegionGeometry]:
+    with open(runtime_path / GEOMETRY_FILE_NAME) as f:
+        entries = json.load(f)
+
+    regions = {region.short_name: region for region in QuadrantsInformation}
+    return {
+        regions[name]: RegionGeometry.from_dict(values)
+        for name, values in entries.items()
+    }
+
+
+def geometries_up_to_date(region_files: list[Path], runtime_path: Path) -> bool:
+    return (runtime_path / GEOMETRY_FILE_NAME).exists() and CacheManifest(
+        runtime_path
+    ).is_fresh(GEOMETRY_FILE_NAME, region_files, GEOMETRY_SCHEMA_VERSION)
+
+
+def load_or_compute_geometries(
+    regions_dict: dict[QuadrantsInformation, CroppedMask],
+    region_files: list[Path],
+    runtime_path: Path,
+) -> dict[QuadrantsInformation, RegionGeometry]:
+    """Region geometries, recomputed when a region file changes."""
+    if geometries_up_to_date(region_files, runtime_path):
+        return load_region_geometries(runtime_path)
+
+    print("Region geometry missing or out of date. Computing it...")
+    geometries = compute_region_geometries(regions_dict)
+    save_region_geometries(geometries, runtime_path)
+    CacheManifest(runtime_path).record(
+        GEOMETRY_FILE_NAME, region_files, GEOMETRY_SCHEMA_VERSION
+    )
+
+    return geometries
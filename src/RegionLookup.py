@@ -0,0 +1,72 @@
+import numpy as np
+
+from CroppedMask import CroppedMask
+from QuadrantInformation import QuadrantsInformation, build_region_label_map
+
+OUTSIDE = 0  # lookup value of voxels outside every region
+
+
+class RegionLookup:
+    """
+    Region of every voxel in one uint8 volume storing `region.id + 1` (0 is
+    outside every region), cropped to the union of the region boxes. The
+    volume is cropped from build_region_label_map, so overlapping regions are
+    resolved the same way everywhere. Queries are a single array read.
+    """
+
+    def __init__(
+        self,
+        ids: np.ndarray,
+        offset: np.ndarray,
+        shape: tuple[int, int, int],
+        spacing: np.ndarray,
+        origin: np.ndarray,
+    ):
+        self.ids = ids
+        self.offset = np.asarray(offset, dtype=int)
+        self.shape = tuple(int(s) for s in shape)
+        self.spacing = np.asarray(spacing, dtype=float)
+        self.origin = np.asarray(origin, dtype=float)
+        self.regions = {region.id + 1: region for region in QuadrantsInformation}
+
+    @classmethod
+    def from_regions(
+        cls, regions_dict: dict[QuadrantsInformation, CroppedMask]
+    ) -> "RegionLookup":
+        grid = next(iter(regions_dict.values()))
+        masks = [mask for mask in regions_dict.values() if not mask.empty]
+        if not masks:
+            return cls(
+                np.zeros((0, 0, 0), np.uint8),
+                np.zeros(3),
+                grid.shape,
+                grid.spacing,
+                grid.origin,
+            )
+
+        box_min = np.min([mask.bbox[0] for mask in masks], axis=0)
+        box_max = np.max([mask.bbox[1] for mask in masks], axis=0)
+        box = tuple(slice(lo, hi + 1) for lo, hi in zip(box_min, box_max))
+        # Copy, so the full size label map is freed
+        ids = build_region_label_map(regions_dict)[box].copy()
+
+        return cls(ids, box_min, grid.shape, grid.spacing, grid.origin)
+
+    def world_to_voxel(self, xyz) -> np.ndarray:
+        return np.rint(
+            (np.asarray(xyz, dtype=float) - self.origin) / self.spacing
+        ).astype(int)
+
+    def ids_at_voxels(self, ijk) -> np.ndarray:
+        """Lookup values of voxels (..., 3), OUTSIDE for voxels off the volume."""
+        local = np.asarray(ijk, dtype=int) - self.offset
+        inside = np.all((local >= 0) & (local < self.ids.shape), axis=-1)
+        values = np.full(inside.shape, OUTSIDE, dtype=np.uint8)
+        values[inside] = self.ids[tuple(local[inside].T)]
+        return values
+
+    def region_at_voxel(self, ijk) -> QuadrantsInformation | None:
+        return self.regions.get(int(self.ids_at_voxels(ijk)))
+
+    def region_at_world(self, xyz) -> QuadrantsInformation | None:
+        return self.region_at_voxel(self.world_to_voxel(xyz))
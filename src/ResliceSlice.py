@@ -0,0 +1,134 @@
+import numpy as np
+import vedo.vtkclasses as vtki
+from vedo import utils
+from vtkmodules.vtkRenderingImage import vtkImageStack  # not in vedo.vtkclasses
+
+from CroppedMask import PLANE_TO_AXIS
+from PackedLabelVolume import PackedLabelVolume
+from SliceCompositor import CT_LEVEL, CT_WINDOW
+
+PLANE_NORMALS = {"x": (1, 0, 0), "y": (0, 1, 0), "z": (0, 0, 1)}
+
+# Largest packed label value the lookup table covers (16 segments)
+MAX_LABEL_COMBINATIONS = 2**16
+
+
+def label_colors(
+    labels: PackedLabelVolume,
+    segment_colors: dict[str, tuple[float, float, float]],
+    alpha: float = 0.3,
+) -> np.ndarray:
+    """
+    RGBA (0-1) of every packed label value up to the largest one in the
+    volume. Overlapping segments are blended in bit order, so drawing the
+    color over the CT gives the same image as composite_slice.
+    """
+    n_values = int(labels.bits.max(initial=0)) + 1
+    if n_values > MAX_LABEL_COMBINATIONS:
+        raise ValueError(
+            f"Packed labels up to {n_values - 1} do not fit in a lookup table, "
+            "use the composite slice mode"
+        )
+
+    values = np.arange(n_values)
+    rgb = np.zeros((n_values, 3))  # premultiplied by the opacity
+    transparency = np.ones(n_values)
+    for name, bit in labels.segment_bits.items():
+        present = (values >> bit & 1).astype(bool)
+        color = np.asarray(segment_colors[name], dtype=float)
+        rgb[present] = rgb[present] * (1.0 - alpha) + color * alpha
+        transparency[present] *= 1.0 - alpha
+
+    opacity = 1.0 - transparency
+    rgba = np.zeros((n_values, 4))
+    covered = opacity > 0
+    rgba[covered, :3] = rgb[covered] / opacity[covered, np.newaxis]
+    rgba[:, 3] = opacity
+    return rgba
+
+
+def label_lookup_table(rgba: np.ndarray):
+    """Lookup table mapping the label value i to rgba[i]."""
+    lut = vtki.vtkLookupTable()
+    lut.SetNumberOfTableValues(len(rgba))
+    lut.SetTableRange(0, len(rgba) - 1)
+    for i, color in enumerate(rgba):
+        lut.SetTableValue(i, *color)
+    lut.Build()
+    return lut
+
+
+def label_image(labels: PackedLabelVolume):
+    """vtkImageData sharing the memory of the packed labels (Fortran order)."""
+    array = labels.bits.ravel(order="F")  # no copy, the volume is Fortran ordered
+    image_data = vtki.vtkImageData()
+    image_data.SetDimensions(labels.shape)
+    image_data.SetSpacing(labels.spacing)
+    image_data.SetOrigin(labels.origin)
+    # The vtk array keeps a reference to `array`
+    scalars = utils.numpy2vtk(array, deep=False)
+    scalars.SetName("labels")
+    image_data.GetPointData().SetScalars(scalars)
+    return image_data
+
+
+class ResliceSlice:
+    """
+    Orthogonal slice of the CT with the segment labels on top, resliced by
+    the mapper from the full volumes (vtkImageResliceMapper). Window/level
+    and label colors are applied by the image properties. Moving the slice
+    only changes the origin of the slice plane, no geometry is created.
+    """
+
+    def __init__(
+        self,
+        ct_image,
+        label_image,
+        label_lut,
+        plane: str,
+        window: float = CT_WINDOW,
+        level: float = CT_LEVEL,
+    ):
+        self.axis = PLANE_TO_AXIS[plane]
+        self.ct_image = ct_image
+        self.slice_plane = vtki.vtkPlane()
+        self.slice_plane.SetNormal(PLANE_NORMALS[plane])
+
+        ct_property = vtki.new("ImageProperty")
+        ct_property.SetColorWindow(window)
+        ct_property.SetColorLevel(level)
+        ct_property.SetInterpolationTypeToNearest()
+        self.ct_slice = self.create_image_slice(ct_image, ct_property)
+
+        label_property = vtki.new("ImageProperty")
+        label_property.SetLookupTable(label_lut)
+        label_property.UseLookupTableScalarRangeOn()
+        label_property.SetInterpolationTypeToNearest()
+        label_property.SetLayerNumber(1)
+        self.label_slice = self.create_image_slice(label_image, label_property)
+
+        # The stack draws the coplanar layers in order, without z-fighting
+        self.actor = vtkImageStack()
+        self.actor.AddImage(self.ct_slice)
+        self.actor.AddImage(self.label_slice)
+        self.actor.SetActiveLayer(0)
+
+    def create_image_slice(self, image_data, image_property):
+        mapper = vtki.new("ImageResliceMapper")
+        mapper.SetInputData(image_data)
+        mapper.SetSlicePlane(self.slice_plane)
+        mapper.SliceFacesCameraOff()
+        mapper.SliceAtFocalPointOff()
+
+        image_slice = vtki.new("ImageSlice")
+        image_slice.SetMapper(mapper)
+        image_slice.SetProperty(image_property)
+        return image_slice
+
+    def update(self, index: int):
+        origin = np.array(self.ct_image.GetOrigin())
+        origin[self.axis] += index * self.ct_image.GetSpacing()[self.axis]
+        self.slice_plane.SetOrigin(origin)
+
+    def bounds(self) -> tuple[float, ...]:
+        return self.ct_image.GetBounds()
@@ -0,0 +1,121 @@
+import json
+import os
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+import nrrd
+import numpy as np
+
+from CacheManifest import CacheManifest
+
+if TYPE_CHECKING:  # vedo is imported on first use, it is slow to import
+    from vedo import Volume
+
+RUNTIME_DIR_NAME = "interface_runtime"
+# Bump when the runtime array or header format changes
+RUNTIME_SCHEMA_VERSION = 1
+
+# Header entries stored as numpy arrays by pynrrd
+_ARRAY_HEADER_KEYS = ("sizes", "space directions", "space origin")
+
+
+def runtime_file_stem(nrrd_path: Path) -> str:
+    """raw_scans_patient_06.nrrd -> raw_scans_patient_06"""
+    return nrrd_path.name.removesuffix(".nrrd")
+
+
+def runtime_paths(nrrd_path: Path, runtime_path: Path) -> tuple[Path, Path]:
+    stem = runtime_file_stem(nrrd_path)
+    return runtime_path / f"{stem}.npy", runtime_path / f"{stem}.header.json"
+
+
+def _encode_header_value(value):
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Unsupported nrrd header value: {type(value)}")
+
+
+def convert_nrrd_to_runtime(nrrd_path: Path, runtime_path: Path) -> tuple[Path, Path]:
+    """
+    One-time conversion of a (gzip) nrrd file into an uncompressed .npy array
+    plus a json header. The .npy file can be memory mapped on later launches.
+    """
+    if not nrrd_path.exists():
+        raise FileNotFoundError(f"Nrrd file not found: {nrrd_path}")
+
+    array_path, header_path = runtime_paths(nrrd_path, runtime_path)
+    array_path.parent.mkdir(parents=True, exist_ok=True)
+
+    data, header = nrrd.read(str(nrrd_path))
+    # Written aside and renamed, a running viewer may still map the old array.
+    # pynrrd returns fortran ordered arrays (x fastest). np.save keeps the order.
+    tmp_array_path = array_path.with_suffix(".tmp")
+    with open(tmp_array_path, "wb") as f:
+        np.save(f, data)
+    os.replace(tmp_array_path, array_path)
+    with open(header_path, "w") as f:
+        json.dump(dict(header), f, default=_encode_header_value, indent=1)
+    CacheManifest(runtime_path).record(
+        array_path.name, [nrrd_path], RUNTIME_SCHEMA_VERSION
+    )
+
+    return array_path, header_path
+
+
+def is_runtime_up_to_date(nrrd_path: Path, runtime_path: Path) -> bool:
+    """
+    The copy is fresh when the nrrd file still has the fingerprint recorded at
+    conversion, so a source restored with an older mtime is converted again.
+    """
+    array_path, header_path = runtime_paths(nrrd_path, runtime_path)
+    if not array_path.exists() or not header_path.exists():
+        return False
+
+    return CacheManifest(runtime_path).is_fresh(
+        array_path.name, [nrrd_path], RUNTIME_SCHEMA_VERSION
+    )
+
+
+def load_runtime_nrrd(nrrd_path: Path, runtime_path: Path) -> tuple[np.memmap, dict]:
+    """
+    Drop-in replacement for `nrrd.read` backed by the runtime cache. Data is
+    returned as a read-only memory map, so only the pages that are accessed are
+    read from disk.
+    """
+    if not is_runtime_up_to_date(nrrd_path, runtime_path):
+        print(f"Converting {nrrd_path.name} to runtime format")
+        convert_nrrd_to_runtime(nrrd_path, runtime_path)
+
+    array_path, header_path = runtime_paths(nrrd_path, runtime_path)
+    data = np.load(array_path, mmap_mode="r")
+    with open(header_path) as f:
+        header = json.load(f)
+
+    for key in _ARRAY_HEADER_KEYS:
+        if key in header:
+            header[key] = np.array(header[key])
+
+    return data, header
+
+
+def spacing_and_origin_from_header(header: dict) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Spacing is the norm of the spatial axes in `space directions`, same as VTK's
+    nrrd reader. For 4D segmentations the leading (list) axis is skipped.
+    """
+    directions = np.asarray(header["space directions"], dtype=float)[-3:]
+    spacing = np.linalg.norm(directions, axis=1)
+    origin = np.asarray(header["space origin"], dtype=float)
+
+    return spacing, origin
+
+
+def load_runtime_volume(nrrd_path: Path, runtime_path: Path) -> "Volume":
+    from vedo import Volume
+
+    data, header = load_runtime_nrrd(nrrd_path, runtime_path)
+    spacing, origin = spacing_and_origin_from_header(header)
+
+    return Volume(data, spacing=spacing, origin=origin)
@@ -0,0 +1,156 @@
+import json
+import re
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+SEGMENT_KEY_PATTERN = re.compile(r"Segment(\d+)_ID")
+
+
+class SegmentationNameNotFoundError(Exception):
+    """Raised when a segmentation name is not found in SegmentationWrapper."""
+
+    pass
+
+
+@dataclass(frozen=True)
+class SegmentInfo:
+    index: int  # N in the SegmentN_* header entries
+    segment_id: str
+    name: str
+    layer: int
+    label_value: int
+    color: tuple[float, float, float]  # rgb in [0, 1]
+    extent: tuple[int, int, int, int, int, int]  # xmin, xmax, ymin, ymax, zmin, zmax
+
+    @property
+    def hex_color(self) -> str:
+        return "#" + "".join(f"{round(c * 255):02x}" for c in self.color)
+
+
+def grid_extent(header: dict) -> tuple[int, int, int, int, int, int]:
+    """
+    Extent of the whole segmentation grid, in the reference image voxels used
+    by the SegmentN_Extent entries.
+    """
+    offset = header.get("Segmentation_ReferenceImageExtentOffset", "0 0 0").split()
+    sizes = [int(s) for s in header["sizes"]][-3:]  # skip the layer axis
+    extent: list[int] = []
+    for o, size in zip(offset, sizes):
+        extent += [int(o), int(o) + size - 1]
+    return tuple(extent)  # type: ignore
+
+
+class SegmentCatalog:
+    """
+    Segment metadata of a 3D Slicer seg.nrrd file, parsed once from the header.
+    Segments can be looked up by name or ID in O(1).
+    """
+
+    def __init__(self, segments: list[SegmentInfo]):
+        self.segments = sorted(segments, key=lambda s: s.index)
+        self._lookup: dict[str, SegmentInfo] = {}
+        self._by_index: dict[int, SegmentInfo] = {}
+        for segment in self.segments:
+            self._lookup[segment.segment_id] = segment
+            self._lookup[segment.name] = segment
+            self._by_index[segment.index] = segment
+
+    @classmethod
+    def from_header(cls, header: dict) -> "SegmentCatalog":
+        segments = []
+        for key in header.keys():
+            match = SEGMENT_KEY_PATTERN.fullmatch(key)
+            if not match:
+                continue
+
+            idx = int(match.group(1))
+            # Without an extent entry the mask is searched in the whole grid
+            extent = header.get(f"Segment{idx}_Extent")
+            segments.append(
+                SegmentInfo(
+                    index=idx,
+                    segment_id=header[f"Segment{idx}_ID"],
+                    name=header.get(f"Segment{idx}_Name", header[f"Segment{idx}_ID"]),
+                    layer=int(header.get(f"Segment{idx}_Layer", 0)),
+                    label_value=int(header.get(f"Segment{idx}_LabelValue", 1)),
+                    color=tuple(
+                        float(c)
+                        for c in header.get(f"Segment{idx}_Color", "1 1 1").split()
+                    ),  # type: ignore
+                    extent=(
+                        tuple(int(e) for e in extent.split())  # type: ignore
+                        if extent is not None
+                        else grid_extent(header)
+                    ),
+                )
+            )
+
+        return cls(segments)
+
+    @classmethod
+    def load(cls, path: Path) -> "SegmentCatalog":
+        with open(path) as f:
+            entries = json.load(f)
+
+        segments = []
+        for entry in entries:
+            entry["color"] = tuple(entry["color"])
+            entry["extent"] = tuple(entry["extent"])
+            segments.append(SegmentInfo(**entry))
+
+        return cls(segments)
+
+    def save(self, path: Path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w") as f:
+            json.dump([asdict(s) for s in self.segments], f, indent=1)
+
+    def get(self, name_or_id: str) -> SegmentInfo:
+        try:
+            return self._lookup[name_or_id]
+        except KeyError:
+            raise SegmentationNameNotFoundError(
+                f"Label '{name_or_id}' not found in segment catalog"
+            )
+
+    def get_by_index(self, index: int) -> SegmentInfo:
+        try:
+            return self._by_index[index]
+        except KeyError:
+            raise SegmentationNameNotFoundError(f"Segment index {index} not found")
+
+    def names(self) -> list[str]:
+        return [s.name for s in self.segments]
+
+    def __contains__(self, name_or_id: str) -> bool:
+        return name_or_id in self._lookup
+
+    def __iter__(self):
+        return iter(self.segments)
+
+    def __len__(self) -> int:
+        return len(self.segments)
+
+
+def catalog_path(segmentation_path: Path, runtime_path: Path | None = None) -> Path:
+    """Catalog is stored in the runtime folder, or next to the nrrd file."""
+    folder = runtime_path if runtime_path is not None else segmentation_path.parent
+    stem = segmentation_path.name.removesuffix(".nrrd")
+    return folder / f"{stem}.segments.json"
+
+
+def catalog_up_to_date(segmentation_path: Path, runtime_path: Path | None = None):
+    path = catalog_path(segmentation_path, runtime_path)
+    return path.exists() and path.stat().st_mtime >= segmentation_path.stat().st_mtime
+
+
+def load_or_build_catalog(
+    segmentation_path: Path, header: dict, runtime_path: Path | None = None
+) -> SegmentCatalog:
+    path = catalog_path(segmentation_path, runtime_path)
+    if catalog_up_to_date(segmentation_path, runtime_path):
+        return SegmentCatalog.load(path)
+
+    catalog = SegmentCatalog.from_header(header)
+    catalog.save(path)
+    return catalog
@@ -1,15 +1,29 @@
-import re
+from dataclasses import dataclass
 from pathlib import Path
+from typing import TYPE_CHECKING
 
 import nrrd
 import numpy as np
-from vedo import Mesh, Volume, colors
 
+from CroppedMask import CroppedMask
+from PackedLabelVolume import PackedLabelVolume
+from RuntimeCache import load_runtime_nrrd, spacing_and_origin_from_header
+from SegmentCatalog import (
+    SegmentationNameNotFoundError,
+    SegmentCatalog,
+    SegmentInfo,
+    load_or_build_catalog,
+)
 
-class SegmentationNameNotFoundError(Exception):
-    """Raised when a segmentation name is not found in SegmentationWrapper."""
+if TYPE_CHECKING:  # vedo is imported on first use, it is slow to import
+    from vedo import Mesh, Volume
 
-    pass
+
+@dataclass
+class SegmentStats:
+    mask: CroppedMask
+    voxel_count: int
+    bbox: tuple[np.ndarray, np.ndarray]  # voxels (min, max inclusive)
 
 
 class SegmentationManager:
@@ -17,52 +31,148 @@ class SegmentationManager:
     Class to manage the loading and processing of segmentation data.
     - Load to seg.nrrd files exported from 3D Slicer into Vedo Volumes.
     - Manages multi-layer nrrd files (segmentations where segments overlap).
+    - If `runtime_path` is given, data is memory mapped from an uncompressed copy
+      stored in `runtime_path` (created on first use).
 
     """
 
-    def __init__(self, segmentation_path: Path):
+    def __init__(self, segmentation_path: Path, runtime_path: Path | None = None):
         self.segmentation_path = segmentation_path
         if not segmentation_path.exists():
             raise FileNotFoundError(f"Segmentation file not found: {segmentation_path}")
 
-        self.data, self.header = nrrd.read(str(segmentation_path))
+        if runtime_path is not None:
+            self.data, self.header = load_runtime_nrrd(segmentation_path, runtime_path)
+        else:
+            self.data, self.header = nrrd.read(str(segmentation_path))
 
         self.spacing, self.origin = self.parse_header()
         self.dimension = self.header["dimension"]
 
-        # Cache for loaded volumes - (LabelValue, Volume)
-        self.cache_volume_dict: dict[str, tuple[int, Volume]] = {}
+        # Segment metadata (name/ID -> index, layer, label value, ...)
+        self.catalog: SegmentCatalog = load_or_build_catalog(
+            segmentation_path, self.header, runtime_path
+        )
 
-    def parse_header(self):
-        # voxel spacing (x,y,z) in mm
-        spacing = np.array(
-            [
-                float(self.header["space directions"][1][0]),  # X
-                float(self.header["space directions"][2][1]),  # Y
-                float(self.header["space directions"][3][2]),  # Z
-            ]
+        # Segment extents are relative to the reference image, not the data array
+        self.extent_offset = np.array(
+            self.header.get("Segmentation_ReferenceImageExtentOffset", "0 0 0").split(),
+            dtype=int,
         )
 
-        origin = self.header["space origin"]
+        # Cache for loaded segments - (LabelValue, CroppedMask)
+        self.cache_volume_dict: dict[str, tuple[int, CroppedMask]] = {}
+        self.segment_stats: dict[str, SegmentStats] = {}
 
-        return spacing, origin
+        # Segment lookup tables, shared by all the slices of a segment
+        self.lut_cache: dict[tuple[str, str], object] = {}
+
+        # All segments bit-packed in a single volume (built on first use)
+        self.packed_labels: PackedLabelVolume | None = None
+
+    def parse_header(self):
+        # voxel spacing (x,y,z) in mm, same as the CT and region volumes
+        return spacing_and_origin_from_header(self.header)
 
-    def get_volume_from_segment_name(self, label_name: str) -> Volume:
+    def get_mask_from_segment_name(self, label_name: str) -> CroppedMask:
+        """
+        Segment mask cropped to its bounding box. Only the segment extent stored
+        in the header is read from the (memory mapped) data.
+        """
         if label_name not in self.cache_volume_dict:
-            label_value = self.get_segment_label_value_from_name(label_name)
+            segment = self.catalog.get(label_name)
             raw_data = self.get_data_from_segment_name(label_name)
-            v = Volume(raw_data, spacing=self.spacing, origin=self.origin)
-            self.cache_volume_dict[label_name] = (label_value, v)
+            extent = (
+                np.array(segment.extent).reshape(3, 2) - self.extent_offset[:, None]
+            )
+            mask = CroppedMask.from_array(
+                raw_data,
+                self.spacing,
+                self.origin,
+                label_value=segment.label_value,
+                search_box=(extent[:, 0], extent[:, 1]),
+            )
+            self.cache_volume_dict[label_name] = (segment.label_value, mask)
 
         return self.cache_volume_dict[label_name][1]
 
+    def get_volume_from_segment_name(self, label_name: str) -> "Volume":
+        """Full size volume with the label value of the segment inside it."""
+        from vedo import Volume
+
+        mask = self.get_mask_from_segment_name(label_name)
+        return Volume(mask.tonumpy(), spacing=self.spacing, origin=self.origin)
+
+    def get_cropped_volume_from_segment_name(self, label_name: str) -> "Volume":
+        """Volume covering the bounding box of the segment."""
+        return self.get_mask_from_segment_name(label_name).to_volume()
+
     def load_volumes_to_cache(self, segment_names: list[str]) -> None:
-        for name in segment_names:
-            self.get_volume_from_segment_name(name)
+        missing = [n for n in segment_names if n not in self.cache_volume_dict]
+        if missing:
+            self.extract_all_segments(missing)
 
-    def get_cache_volume_dict(self) -> dict[str, tuple[int, Volume]]:
+    def extract_all_segments(
+        self, segment_names: list[str] | None = None
+    ) -> dict[str, SegmentStats]:
+        """
+        Masks, voxel counts and bounding boxes of all segments (or of
+        `segment_names`). Each layer is scanned once with `find_objects`, which
+        returns the bounding box of every label value. The rest of the work only
+        touches the bounding boxes.
+        """
+        if segment_names is None:
+            segment_names = self.catalog.names()
+        segments = [self.catalog.get(name) for name in segment_names]
+
+        from scipy import ndimage
+
+        layers = self.data if self.data.ndim > 3 else self.data[np.newaxis]
+        for layer_idx in sorted({s.layer for s in segments}):
+            layer = layers[layer_idx]
+            layer_segments = [s for s in segments if s.layer == layer_idx]
+            boxes = ndimage.find_objects(
+                layer, max_label=max(s.label_value for s in layer_segments)
+            )
+
+            for segment in layer_segments:
+                box = boxes[segment.label_value - 1]
+                if box is None:
+                    crop = np.zeros((0, 0, 0), dtype=bool)
+                    offset = np.zeros(3, dtype=int)
+                else:
+                    crop = np.asarray(layer[box]) == segment.label_value
+                    offset = np.array([sl.start for sl in box])
+
+                mask = CroppedMask(
+                    crop,
+                    offset,
+                    layer.shape,
+                    self.spacing,
+                    self.origin,
+                    label_value=segment.label_value,
+                )
+                self.cache_volume_dict[segment.name] = (segment.label_value, mask)
+                self.segment_stats[segment.name] = SegmentStats(
+                    mask=mask, voxel_count=mask.voxel_count(), bbox=mask.bbox
+                )
+
+        return {name: self.segment_stats[name] for name in segment_names}
+
+    def get_cache_volume_dict(self) -> dict[str, tuple[int, CroppedMask]]:
         return self.cache_volume_dict
 
+    def get_packed_labels(self) -> PackedLabelVolume:
+        if self.packed_labels is None:
+            self.packed_labels = PackedLabelVolume.from_segmentation(
+                self.data, self.catalog, self.spacing, self.origin
+            )
+        return self.packed_labels
+
+    def get_slice_masks(self, plane: str, index: int) -> dict[str, np.ndarray]:
+        """Bool 2D slices of all segments, read from the bit-packed volume."""
+        return self.get_packed_labels().segment_slices(plane, index)
+
     def get_data_from_segment_name(self, label_name: str):
         """
         In case of overlapping segments, data might be split in multiple volumes.
@@ -76,73 +186,65 @@ class SegmentationManager:
         else:
             raise ValueError("Unsupported data shape")
 
+    def get_segment_info(self, label_name: str) -> SegmentInfo:
+        return self.catalog.get(label_name)
+
+    def segment_names(self) -> list[str]:
+        return self.catalog.names()
+
     def get_segment_layer(self, label_name: str) -> int:
         """For multi-layer nrrd files"""
-        segment_id = self.find_segment_index(label_name)
-        segment_layer = self.header[f"Segment{segment_id}_Layer"]
-        return int(segment_layer)
+        return self.catalog.get(label_name).layer
 
     def get_segment_label_value_from_name(self, label_name: str) -> int:
-        segment_index = self.find_segment_index(label_name)
-        return self.get_segment_label_value(segment_index)
+        return self.catalog.get(label_name).label_value
 
     def get_segment_label_value(self, segment_index: int) -> int:
-        return int(self.header[f"Segment{segment_index}_LabelValue"])
-
-    def parse_id_from_header_entry(self, key_name: str) -> int:
-        match = re.search(r"Segment(\d+)_(Name|ID)", key_name)
-        if match:
-            id = int(match.group(1))
-            return id
-        else:
-            raise ValueError(f"Invalid segment format. Provided key: {key_name}")
+        return self.catalog.get_by_index(segment_index).label_value
 
     def find_segment_index(self, label_name: str) -> int:
-        for key, value in self.header.items():
-            if not isinstance(value, str):
-                continue
-
-            # Only process SegmentX_ID or SegmentX_Name
-            if "Segment" not in key or ("ID" not in key and "Name" not in key):
-                continue
-
-            if value == label_name:
-                segment_id = self.parse_id_from_header_entry(key)
-                return segment_id
-
-        raise SegmentationNameNotFoundError(
-            f"Label '{label_name}' not found in {self.segmentation_path}"
-        )
-
-    def get_slice(self, segment_name: str, index: int, plane: str, color: str) -> Mesh:
+        return self.catalog.get(label_name).index
+
+    def get_lut(self, segment_name: str, color: str):
+        """Lookup table of a segment, built once per (segment, color)."""
+        key = (segment_name, color)
+        if key not in self.lut_cache:
+            from vedo import colors
+
+            segment_label_value = self.catalog.get(segment_name).label_value
+            self.lut_cache[key] = colors.build_lut(
+                [
+                    (0, (0, 0, 1), 0.0),  # everything else transparent
+                    (segment_label_value, color),
+                ],
+                vmin=0,
+                vmax=segment_label_value,
+            )
+
+        return self.lut_cache[key]
+
+    def get_slice(
+        self, segment_name: str, index: int, plane: str, color: str
+    ) -> "Mesh":
         assert plane in ["x", "y", "z"], "Plane must be 'x', 'y' or 'z'"
 
-        segment_index = self.find_segment_index(segment_name)
-        segment_label_value = self.get_segment_label_value(segment_index)
-        segment_volume = self.get_volume_from_segment_name(segment_name)
-
-        # print(f"segment name: {segment_name} segment index: {segment_index}")
-        # print(f"Segment Label Value: {segment_label_value}")
+        segment_mask = self.get_mask_from_segment_name(segment_name)
 
         if plane == "x":
-            seg_slice = segment_volume.xslice(index)
+            seg_slice = segment_mask.xslice(index)
         elif plane == "y":
-            seg_slice = segment_volume.yslice(index)
+            seg_slice = segment_mask.yslice(index)
         elif plane == "z":
-            seg_slice = segment_volume.zslice(index)
+            seg_slice = segment_mask.zslice(index)
         else:
             raise ValueError(f"Invalid plane: {plane}")
 
+        # Slice does not cross the segment bounding box
+        if seg_slice.npoints == 0:
+            return seg_slice
+
         # Set color of segment
-        lut = colors.build_lut(
-            [
-                (0, (0, 0, 1), 0.0),  # everything else transparent
-                (segment_label_value, color),
-            ],
-            vmin=0,
-            vmax=segment_label_value,
-        )
-        seg_slice.cmap(lut)
+        seg_slice.cmap(self.get_lut(segment_name, color))
         seg_slice.alpha(0.3)
 
         return seg_slice
@@ -0,0 +1,143 @@
+import multiprocessing as mp
+from collections.abc import Callable, Hashable
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from multiprocessing import shared_memory
+from typing import Any
+
+import numpy as np
+
+from CroppedMask import CroppedMask
+
+
+@dataclass(frozen=True)
+class MaskSpec:
+    """Where a cropped mask lives in the shared block, plus its grid metadata."""
+
+    start: int
+    data_shape: tuple[int, int, int]
+    offset: tuple[int, int, int]
+    shape: tuple[int, int, int]
+    spacing: tuple[float, float, float]
+    origin: tuple[float, float, float]
+    label_value: int
+
+
+class SharedMasks:
+    """
+    Cropped masks copied once into a single shared memory block. Workers attach
+    to the block by name and wrap their part in CroppedMasks without copying,
+    so only the small MaskSpecs are pickled.
+    """
+
+    def __init__(self, masks: dict[Hashable, CroppedMask]):
+        self.specs: dict[Hashable, MaskSpec] = {}
+        total = 0
+        for key, mask in masks.items():
+            self.specs[key] = MaskSpec(
+                start=total,
+                data_shape=tuple(int(n) for n in mask.data.shape),  # type: ignore
+                offset=tuple(int(o) for o in mask.offset),  # type: ignore
+                shape=mask.shape,  # type: ignore
+                spacing=tuple(float(s) for s in mask.spacing),  # type: ignore
+                origin=tuple(float(o) for o in mask.origin),  # type: ignore
+                label_value=int(mask.label_value),
+            )
+            total += mask.data.size
+
+        self.shm = shared_memory.SharedMemory(create=True, size=max(total, 1))
+        buffer = np.ndarray((total,), dtype=bool, buffer=self.shm.buf)
+        for key, mask in masks.items():
+            spec = self.specs[key]
+            buffer[spec.start : spec.start + mask.data.size] = mask.data.ravel()
+
+    @property
+    def name(self) -> str:
+        return self.shm.name
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+    def __enter__(self) -> "SharedMasks":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def attach_masks(
+    shm: shared_memory.SharedMemory, specs: dict[Hashable, MaskSpec]
+) -> dict[Hashable, CroppedMask]:
+    masks: dict[Hashable, CroppedMask] = {}
+    for key, spec in specs.items():
+        size = int(np.prod(spec.data_shape))
+        data = (
+            np.ndarray(spec.data_shape, dtype=bool, buffer=shm.buf, offset=spec.start)
+            if size > 0
+            else np.zeros(spec.data_shape, dtype=bool)
+        )
+        masks[key] = CroppedMask(
+            data,
+            np.array(spec.offset),
+            spec.shape,
+            np.array(spec.spacing),
+            np.array(spec.origin),
+            label_value=spec.label_value,
+        )
+    return masks
+
+
+## Worker process state, set once by _init_worker
+_worker_shm: shared_memory.SharedMemory | None = None
+_worker_masks: dict[Hashable, CroppedMask] = {}
+_worker_state: dict[str, Any] = {}
+
+
+def _init_worker(shm_name: str, specs: dict[Hashable, MaskSpec], make_state):
+    global _worker_shm, _worker_masks, _worker_state
+    # Spawned workers share the resource tracker of the parent, which owns
+    # (and unlinks) the block
+    _worker_shm = shared_memory.SharedMemory(name=shm_name)
+    _worker_masks = attach_masks(_worker_shm, specs)
+    _worker_state = {"state": make_state() if make_state is not None else None}
+
+
+def _run_pair(task_fn: Callable, key_a: Hashable, key_b: Hashable):
+    return task_fn(_worker_masks[key_a], _worker_masks[key_b], _worker_state["state"])
+
+
+def process_context() -> mp.context.BaseContext:
+    """
+    fork starts workers without re-importing the viewer modules. Workers only
+    run numpy/scipy, they never touch inherited VTK state.
+    """
+    start_method = "fork" if "fork" in mp.get_all_start_methods() else "spawn"
+    return mp.get_context(start_method)
+
+
+def map_mask_pairs(
+    task_fn: Callable[[CroppedMask, CroppedMask, Any], Any],
+    masks: dict[Hashable, CroppedMask],
+    pairs: list[tuple[Hashable, Hashable]],
+    max_workers: int,
+    make_state: Callable[[], Any] | None = None,
+) -> list:
+    """
+    Run `task_fn(masks[a], masks[b], state)` for every pair (a, b) in a process
+    pool. `task_fn` and `make_state` must be module level functions. `state` is
+    created once per worker by `make_state` (e.g. scratch buffers). Results are
+    returned in the order of `pairs`, whatever order the workers finish in.
+    """
+    if not pairs:
+        return []
+
+    with SharedMasks(masks) as shared:
+        with ProcessPoolExecutor(
+            max_workers=min(max_workers, len(pairs)),
+            mp_context=process_context(),
+            initializer=_init_worker,
+            initargs=(shared.name, shared.specs, make_state),
+        ) as executor:
+            futures = [executor.submit(_run_pair, task_fn, a, b) for a, b in pairs]
+            return [future.result() for future in futures]
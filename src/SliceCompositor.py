@@ -0,0 +1,84 @@
+import numpy as np
+import vedo.vtkclasses as vtki
+from vedo import utils
+
+from CroppedMask import PLANE_TO_AXIS
+
+# Window level for soft tissue
+CT_WINDOW = 400
+CT_LEVEL = 50
+
+
+def window_level(ct_slice: np.ndarray, window: float, level: float) -> np.ndarray:
+    """Map CT intensities to [0, 1] gray values."""
+    vmin = level - window / 2
+    gray = (ct_slice.astype(np.float32) - vmin) / window
+    return np.clip(gray, 0.0, 1.0, out=gray)
+
+
+def composite_slice(
+    ct_slice: np.ndarray,
+    segment_masks: dict[str, np.ndarray],
+    segment_colors: dict[str, tuple[float, float, float]],
+    alpha: float = 0.3,
+    window: float = CT_WINDOW,
+    level: float = CT_LEVEL,
+) -> np.ndarray:
+    """
+    Window the CT slice and alpha blend the segment colors on top of it.
+    Returns an opaque RGBA uint8 image with the same 2D shape as `ct_slice`.
+    """
+    gray = window_level(ct_slice, window, level)
+    rgb = np.repeat(gray[..., np.newaxis], 3, axis=2)
+
+    for name, mask in segment_masks.items():
+        if not mask.any():
+            continue
+        color = np.asarray(segment_colors[name], dtype=np.float32)
+        rgb[mask] = rgb[mask] * (1.0 - alpha) + color * alpha
+
+    rgba = np.empty(gray.shape + (4,), dtype=np.uint8)
+    rgba[..., :3] = np.rint(rgb * 255)
+    rgba[..., 3] = 255
+    return rgba
+
+
+class CompositeSlice:
+    """
+    Orthogonal slice displayed as a single textured actor (vtkImageActor). The
+    image lives in the voxel grid of the CT, so it is placed at its world
+    position without any extra transform.
+    """
+
+    def __init__(self, spacing, origin):
+        self.spacing = np.asarray(spacing, dtype=float)
+        self.origin = np.asarray(origin, dtype=float)
+
+        self.image_data = vtki.vtkImageData()
+        self.image_data.SetSpacing(self.spacing)
+        self.image_data.SetOrigin(self.origin)
+
+        self.actor = vtki.new("ImageActor")
+        self.actor.SetInputData(self.image_data)
+        self.actor.InterpolateOff()
+
+    def update(self, rgba: np.ndarray, plane: str, index: int):
+        """`rgba` is a (n0, n1, 4) image of the slice at `index` along `plane`."""
+        axis = PLANE_TO_AXIS[plane]
+        extent = [0, 0, 0, 0, 0, 0]
+        in_plane_axes = [a for a in range(3) if a != axis]
+        for a, n in zip(in_plane_axes, rgba.shape[:2]):
+            extent[2 * a + 1] = n - 1
+        extent[2 * axis] = extent[2 * axis + 1] = index
+
+        # VTK scalars are ordered with the first axis running fastest
+        scalars = utils.numpy2vtk(rgba.transpose(1, 0, 2).reshape(-1, 4))
+        scalars.SetName("rgba")
+
+        self.image_data.SetExtent(extent)
+        self.image_data.GetPointData().SetScalars(scalars)
+        self.image_data.Modified()
+        self.actor.SetDisplayExtent(extent)
+
+    def bounds(self) -> tuple[float, ...]:
+        return self.actor.GetBounds()
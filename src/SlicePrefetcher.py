@@ -0,0 +1,86 @@
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Generic, TypeVar
+
+T = TypeVar("T")
+
+
+class SlicePrefetcher(Generic[T]):
+    """
+    Prepares slices in background threads while the user scrolls. After every
+    step, the next `depth` indices in the scroll direction (and one behind) are
+    scheduled, so the following steps only need to pick up the result.
+
+    `prepare_fn(plane, index)` must be thread safe, e.g. numpy work on memory
+    mapped arrays. VTK objects should be created on the main thread.
+    """
+
+    def __init__(
+        self,
+        prepare_fn: Callable[[str, int], T],
+        n_slices: dict[str, int],
+        depth: int = 4,
+        max_workers: int = 2,
+        max_entries: int = 96,
+    ):
+        self.prepare_fn = prepare_fn
+        self.n_slices = n_slices
+        self.depth = depth
+        self.max_entries = max_entries
+        self.executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="slice-prefetch"
+        )
+        self._futures: OrderedDict[tuple[str, int], Future[T]] = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, plane: str, index: int) -> T:
+        """Prepared slice. Waits for a pending prefetch or prepares it now."""
+        key = (plane, index)
+        future = self._futures.get(key)
+        if future is not None:
+            self._futures.move_to_end(key)
+            self.hits += 1
+            return future.result()
+
+        self.misses += 1
+        result = self.prepare_fn(plane, index)
+        done: Future[T] = Future()
+        done.set_result(result)
+        self._store(key, done)
+        return result
+
+    def prefetch(self, plane: str, index: int, direction: int):
+        """Schedule the neighbours of `index` in the scroll direction."""
+        step = 1 if direction >= 0 else -1
+        offsets = [step * k for k in range(1, self.depth + 1)] + [-step]
+        for offset in offsets:
+            neighbour = index + offset
+            if not 0 <= neighbour < self.n_slices[plane]:
+                continue
+
+            key = (plane, neighbour)
+            if key in self._futures:
+                self._futures.move_to_end(key)
+                continue
+            self._store(key, self.executor.submit(self.prepare_fn, plane, neighbour))
+
+    def _store(self, key: tuple[str, int], future: Future[T]):
+        self._futures[key] = future
+        while len(self._futures) > self.max_entries:
+            _, oldest = self._futures.popitem(last=False)
+            oldest.cancel()
+
+    def clear(self):
+        for future in self._futures.values():
+            future.cancel()
+        self._futures.clear()
+
+    def shutdown(self):
+        self.clear()
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self) -> dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": len(self._futures)}
@@ -0,0 +1,42 @@
+from pathlib import Path
+
+
+def stat_key(path: Path) -> tuple[int, int] | None:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+
+class SourceWatcher:
+    """
+    Polls the size and mtime of files (stat only, no reads). A change is
+    reported once the file kept the same stat for two polls in a row, so a file
+    still being written (e.g. saved from 3D Slicer) is not read half way.
+    """
+
+    def __init__(self, paths: list[Path]):
+        self.paths = list(paths)
+        self._seen = {path: stat_key(path) for path in self.paths}
+        self._pending: dict[Path, tuple[int, int]] = {}
+
+    def poll(self) -> list[Path]:
+        """Files changed (and settled) since they were last reported."""
+        changed = []
+        for path in self.paths:
+            stat = stat_key(path)
+            if stat == self._seen[path]:
+                self._pending.pop(path, None)
+                continue
+            if stat is None:  # being replaced, wait for the new file
+                continue
+            if self._pending.get(path) != stat:
+                self._pending[path] = stat
+                continue
+
+            del self._pending[path]
+            self._seen[path] = stat
+            changed.append(path)
+
+        return changed
@@ -0,0 +1,47 @@
+import numpy as np
+import vedo.vtkclasses as vtki
+from vedo import Mesh
+
+from CroppedMask import PLANE_TO_AXIS
+
+
+class VolumeSlice:
+    """
+    Orthogonal slice of an image shown by a persistent mesh. The geometry
+    filter, actor, mapper and lookup table are created once; moving the slice
+    only changes the extent of the filter. `offset` is the voxel index of the
+    first image voxel in the full grid, for images cropped to a bounding box
+    (CroppedMask.to_volume). Slices outside the image are hidden.
+    """
+
+    def __init__(self, image_data, plane: str, offset=(0, 0, 0)):
+        self.axis = PLANE_TO_AXIS[plane]
+        self.offset = np.asarray(offset, dtype=int)
+        self.dimensions = image_data.GetDimensions()
+
+        self.geometry_filter = vtki.new("ImageDataGeometryFilter")
+        self.geometry_filter.SetInputData(image_data)
+        self.set_local_index(0)
+        # The filter output is updated in place, the mesh keeps wrapping it
+        self.mesh = Mesh(self.geometry_filter.GetOutput())
+        self.actor = self.mesh.actor
+
+    def set_local_index(self, local: int):
+        extent = [0, 0, 0, 0, 0, 0]
+        for a, n in enumerate(self.dimensions):
+            extent[2 * a + 1] = n - 1
+        extent[2 * self.axis] = extent[2 * self.axis + 1] = local
+        self.geometry_filter.SetExtent(extent)
+        self.geometry_filter.Update()
+
+    def update(self, index: int):
+        local = int(index) - self.offset[self.axis]
+        if not 0 <= local < self.dimensions[self.axis]:
+            self.mesh.off()
+            return
+
+        self.set_local_index(local)
+        self.mesh.on()
+
+    def bounds(self) -> np.ndarray:
+        return self.mesh.bounds()
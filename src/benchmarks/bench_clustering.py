@@ -0,0 +1,313 @@
+import contextlib
+import io
+import json
+import multiprocessing as mp
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from collections.abc import Callable
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))  # src/
+
+import click
+import numpy as np
+import scipy
+import scipy.ndimage  # noqa: F401
+import scipy.spatial  # noqa: F401
+from synthetic_volumes import (
+    DEFAULT_LESIONS,
+    SHAPE,
+    LesionSpec,
+    disease_masks,
+    region_masks,
+)
+
+from ClusterStatistics import ClusterScratch, compute_target
+from DiseaseClusterManager import DiseaseClusterManager
+
+RESULTS_PATH = Path(__file__).resolve().parent / "results"
+
+## scipy.ndimage and scipy.spatial are imported on first use by the
+## clustering code (about 0.3 s). They are imported here, so the forked
+## cases inherit them and do not time the import.
+
+# Runs are only comparable when these are equal
+CONFIG_KEYS = ("shape", "seed", "lesions")
+
+# Cases this much slower than the baseline are flagged
+REGRESSION_THRESHOLD = 1.1
+
+
+@dataclass
+class CaseResult:
+    name: str
+    wall_s: list[float]  # one per repeat
+    peak_rss_mb: float  # max over repeats, process running the case
+    workers_peak_rss_mb: float  # largest pool worker, 0 without pool
+    clusters: int
+
+    @property
+    def best_wall_s(self) -> float:
+        return min(self.wall_s)
+
+    def to_dict(self) -> dict:
+        return {
+            **asdict(self),
+            "best_wall_s": self.best_wall_s,
+            "median_wall_s": statistics.median(self.wall_s),
+            "clusters_per_s": self.clusters / self.best_wall_s,
+        }
+
+
+def max_rss_mb(who: int) -> float:
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return resource.getrusage(who).ru_maxrss * scale / 2**20
+
+
+def current_rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+    except FileNotFoundError:
+        return 0.0
+
+
+def _run_child(task: Callable[[], int], connection):
+    baseline = current_rss_mb()
+    with contextlib.redirect_stdout(io.StringIO()):  # progress prints
+        start = time.perf_counter()
+        clusters = task()
+        wall = time.perf_counter() - start
+    connection.send(
+        (
+            wall,
+            # the forked process starts at the RSS of the parent
+            max_rss_mb(resource.RUSAGE_SELF) - baseline,
+            max_rss_mb(resource.RUSAGE_CHILDREN),
+            clusters,
+        )
+    )
+
+
+def measure(name: str, task: Callable[[], int], repeat: int) -> CaseResult:
+    """Run `task` (returns the number of clusters) `repeat` times."""
+    context = mp.get_context("fork")
+    walls, peaks, worker_peaks = [], [], []
+    clusters = 0
+    for _ in range(repeat):
+        receiver, sender = context.Pipe(duplex=False)
+        process = context.Process(target=_run_child, args=(task, sender))
+        process.start()
+        wall, peak, worker_peak, clusters = receiver.recv()
+        process.join()
+        walls.append(wall)
+        peaks.append(peak)
+        worker_peaks.append(worker_peak)
+
+    result = CaseResult(name, walls, max(peaks), max(worker_peaks), clusters)
+    print(
+        f"  {name:<45} {result.best_wall_s * 1000:9.1f} ms "
+        f"{result.peak_rss_mb:8.1f} MB {clusters:6d} clusters"
+    )
+    return result
+
+
+def count_clusters(dict_clusters) -> int:
+    return sum(len(c) for d in dict_clusters.values() for c in d.values())
+
+
+def build_manager(regions, diseases, **kwargs) -> int:
+    with tempfile.TemporaryDirectory() as root:
+        manager = DiseaseClusterManager(Path(root), regions, diseases, **kwargs)
+        return count_clusters(manager.dict_clusters)
+
+
+def git_commit() -> str:
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+        dirty = subprocess.run(
+            ["git", "status", "--porcelain", "--untracked-files=no"],
+            capture_output=True,
+            text=True,
+            cwd=Path(__file__).parent,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return f"{commit}-dirty" if dirty else commit
+
+
+def compare(results: dict, baseline: dict):
+    old_cases = {case["name"]: case for case in baseline["cases"]}
+    print(f"\nCompared to {baseline['meta']['commit']}:")
+    for key in CONFIG_KEYS:
+        if results["meta"][key] != baseline["meta"].get(key):
+            print(f"  Warning: different {key} ({baseline['meta'].get(key)})")
+    for case in results["cases"]:
+        old = old_cases.get(case["name"])
+        if old is None:
+            continue
+        ratio = case["best_wall_s"] / old["best_wall_s"]
+        flag = "  <-- slower" if ratio > REGRESSION_THRESHOLD else ""
+        print(
+            f"  {case['name']:<45} {ratio:6.2f}x time, "
+            f"{case['peak_rss_mb'] - old['peak_rss_mb']:+8.1f} MB{flag}"
+        )
+
+
+@click.command()
+@click.option(
+    "--shape", type=int, nargs=3, default=SHAPE, show_default=True, help="Volume size."
+)
+@click.option(
+    "--lesions",
+    multiple=True,
+    help="Lesions of one disease as NAME=COUNT:MIN-MAX (radius in voxels), "
+    "e.g. 'carcinosis=150:2-6'. Repeatable, replaces the defaults: "
+    + ", ".join(
+        f"{n}={s.count}:{s.min_radius:g}-{s.max_radius:g}"
+        for n, s in DEFAULT_LESIONS.items()
+    ),
+)
+@click.option("--seed", type=int, default=0, show_default=True)
+@click.option("--repeat", type=int, default=3, show_default=True)
+@click.option(
+    "--workers",
+    type=int,
+    default=4,
+    show_default=True,
+    help="Processes of the parallel calculate_clusters case.",
+)
+@click.option(
+    "--enclosing-sphere",
+    is_flag=True,
+    help="Also time calculate_clusters with minimum enclosing spheres (slow).",
+)
+@click.option(
+    "--output",
+    type=click.Path(dir_okay=False, path_type=Path),
+    default=None,
+    help="JSON file for the results. Default: results/<date>_<commit>.json",
+)
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False, path_type=Path),
+    default=None,
+    help="Results of an earlier run to compare with.",
+)
+def main(
+    shape: tuple[int, int, int],
+    lesions: tuple[str, ...],
+    seed: int,
+    repeat: int,
+    workers: int,
+    enclosing_sphere: bool,
+    output: Path | None,
+    baseline: Path | None,
+):
+    """
+    Benchmark compute_target per (region, disease) pair and calculate_clusters
+    on synthetic volumes. Every case runs in a forked process, so its peak RSS
+    is not hidden by an earlier case. Results are saved as JSON, named after
+    the commit, and can be compared with an earlier run (--baseline).
+    """
+    lesion_specs = DEFAULT_LESIONS
+    if lesions:
+        lesion_specs = {}
+        for text in lesions:
+            name, spec = text.split("=")
+            lesion_specs[name] = LesionSpec.parse(spec)
+
+    start = time.perf_counter()
+    regions = region_masks(shape)
+    diseases = disease_masks(lesion_specs, shape, seed)
+    print(
+        f"Synthetic volume {shape}: {len(regions)} regions, "
+        f"{len(diseases)} diseases ({time.perf_counter() - start:.1f} s)"
+    )
+
+    cases = []
+    print("Per (region, disease) pair, compute_target:")
+    for region, region_mask in regions.items():
+        for disease, (_, disease_mask) in diseases.items():
+            cases.append(
+                measure(
+                    f"pair {region.short_name} / {disease}",
+                    lambda d=disease_mask, r=region_mask: len(
+                        compute_target(d, r, ClusterScratch())
+                    ),
+                    repeat,
+                )
+            )
+
+    print("calculate_clusters (DiseaseClusterManager cold start, store included):")
+    pipelines = {
+        "pairwise": {"clustering_mode": "pairwise"},
+        f"pairwise, {workers} workers": {
+            "clustering_mode": "pairwise",
+            "workers": workers,
+        },
+        "region_map": {"clustering_mode": "region_map"},
+    }
+    if enclosing_sphere:
+        pipelines["pairwise, enclosing sphere"] = {
+            "clustering_mode": "pairwise",
+            "enclosing_sphere": True,
+        }
+    for name, kwargs in pipelines.items():
+        cases.append(
+            measure(
+                f"calculate_clusters {name}",
+                lambda kwargs=kwargs: build_manager(regions, diseases, **kwargs),
+                repeat,
+            )
+        )
+
+    results = {
+        "meta": {
+            "commit": git_commit(),
+            "date": datetime.now().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "numpy": np.__version__,
+            "scipy": scipy.__version__,
+            "machine": platform.machine(),
+            "cpu_count": mp.cpu_count(),
+            "shape": list(shape),
+            "seed": seed,
+            "repeat": repeat,
+            "lesions": {name: asdict(spec) for name, spec in lesion_specs.items()},
+            "lesion_voxels": {
+                name: mask.voxel_count() for name, (_, mask) in diseases.items()
+            },
+        },
+        "cases": [case.to_dict() for case in cases],
+    }
+
+    if output is None:
+        stamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        output = RESULTS_PATH / f"{stamp}_{results['meta']['commit']}.json"
+    output.parent.mkdir(parents=True, exist_ok=True)
+    with open(output, "w") as f:
+        json.dump(results, f, indent=1)
+    print(f"Results saved to {output}")
+
+    if baseline is not None:
+        with open(baseline) as f:
+            compare(results, json.load(f))
+
+
+if __name__ == "__main__":
+    main()
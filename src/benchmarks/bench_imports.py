@@ -0,0 +1,124 @@
+import json
+import subprocess
+import sys
+from pathlib import Path
+
+import click
+
+SRC_PATH = Path(__file__).resolve().parents[1]
+
+## Cold import budget (ms, best of --repeat fresh interpreters) of the modules
+## loaded when the viewer or the precompute command start. Measured around
+## 130-250 ms for the light modules and 480 ms for main (vedo included);
+## importing seaborn or scipy at module level costs 0.5-2 s.
+IMPORT_BUDGETS_MS = {
+    "QuadrantInformation": 300,
+    "CroppedMask": 300,
+    "RuntimeCache": 300,
+    "SegmentationManager": 400,
+    "ClusterStatistics": 300,
+    "DiseaseClusterManager": 500,
+    "RegionGeometry": 300,
+    "precompute": 500,
+    "main": 1000,
+}
+
+# Loaded on first use only. The viewer (main) needs vedo at import.
+HEAVY_MODULES = ("seaborn", "matplotlib", "scipy.ndimage", "scipy.spatial", "vedo")
+ALLOWED_HEAVY_MODULES = {"main": ("vedo",)}
+
+MEASURE_IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{"ms": elapsed * 1000, "modules": sorted(sys.modules)}}))
+"""
+
+
+def measure_import(module: str) -> tuple[float, set[str]]:
+    """Import time (ms) of `module` in a fresh interpreter and modules loaded."""
+    completed = subprocess.run(
+        [sys.executable, "-c", MEASURE_IMPORT.format(module=module)],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=SRC_PATH,
+    )
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    return result["ms"], set(result["modules"])
+
+
+def slowest_imports(module: str, count: int = 8) -> list[tuple[int, str]]:
+    """Top level imports of `module` with the largest cumulative time (us)."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        capture_output=True,
+        text=True,
+        check=True,
+        cwd=SRC_PATH,
+    )
+    lines = [
+        line.split("|")[1:]
+        for line in completed.stderr.splitlines()
+        if line.startswith("import time:") and "cumulative" not in line
+    ]
+    # Children are listed before their parent, indented two more spaces
+    entries = []
+    for cumulative, name in reversed(lines[:-1]):
+        depth = len(name) - len(name.lstrip())
+        if depth <= 1:  # imported before `module`, interpreter startup
+            break
+        if depth == 3:
+            entries.append((int(cumulative), name.strip()))
+
+    return sorted(entries, reverse=True)[:count]
+
+
+@click.command()
+@click.option("--repeat", type=int, default=5, show_default=True)
+@click.option(
+    "--scale",
+    type=float,
+    default=1.0,
+    show_default=True,
+    help="Multiply every budget, for slower machines.",
+)
+def main(repeat: int, scale: float):
+    """
+    Cold import time of the viewer modules, each in fresh interpreters. Fails
+    when a module goes over its budget or imports a heavy dependency
+    (seaborn, scipy, vedo...) that should only be loaded on first use.
+    """
+    failures = []
+    for module, budget in IMPORT_BUDGETS_MS.items():
+        budget *= scale
+        timings, loaded = [], set()
+        for _ in range(repeat):
+            ms, loaded = measure_import(module)
+            timings.append(ms)
+        best = min(timings)
+
+        allowed = ALLOWED_HEAVY_MODULES.get(module, ())
+        heavy = [m for m in HEAVY_MODULES if m in loaded and m not in allowed]
+        over_budget = best > budget
+        status = "ok"
+        if over_budget or heavy:
+            status = "FAIL"
+            failures.append(module)
+        print(
+            f"  {module:<25} {best:7.1f} ms (budget {budget:6.0f} ms) {status}"
+            + (f", imports {', '.join(heavy)}" if heavy else "")
+        )
+        if over_budget:
+            for cumulative, name in slowest_imports(module):
+                print(f"      {cumulative / 1000:8.1f} ms  {name}")
+
+    if failures:
+        print(f"Import budget exceeded: {', '.join(failures)}")
+        raise SystemExit(1)
+    print("All imports within budget")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,119 @@
+from dataclasses import dataclass
+
+import numpy as np
+
+from CroppedMask import CroppedMask, crop_to_bbox
+from QuadrantInformation import QuadrantsInformation
+
+SHAPE = (512, 512, 300)
+SPACING = np.array([0.8, 0.8, 1.5])
+ORIGIN = np.zeros(3)
+
+## Regions tile a box inside the volume: 3 bands along z, split along x.
+## (region, z band, x start fraction, x end fraction)
+REGION_LAYOUT = (
+    (QuadrantsInformation.PELVIC_REGION, 0, 0.0, 0.5),
+    (QuadrantsInformation.SMALL_BOWEL, 0, 0.5, 1.0),
+    (QuadrantsInformation.LEFT_FLANK_AND_BOWEL, 1, 0.0, 0.3),
+    (QuadrantsInformation.CENTRAL_AND_BOWEL, 1, 0.3, 0.7),
+    (QuadrantsInformation.RIGHT_FLANK_AND_BOWEL, 1, 0.7, 1.0),
+    (QuadrantsInformation.LEFT_UPPER_QUADRANT, 2, 0.0, 0.5),
+    (QuadrantsInformation.UPPER_RIGHT_QUADRANT, 2, 0.5, 1.0),
+)
+BODY_BOX = (np.array([0.1, 0.15, 0.05]), np.array([0.9, 0.85, 0.95]))  # fractions
+REGION_OVERLAP = 2  # voxels, annotated regions overlap a little
+
+
+@dataclass(frozen=True)
+class LesionSpec:
+    count: int
+    min_radius: float  # voxels
+    max_radius: float
+
+    @classmethod
+    def parse(cls, text: str) -> "LesionSpec":
+        """'COUNT:MIN-MAX', e.g. '150:2-6'."""
+        count, radii = text.split(":")
+        min_radius, max_radius = radii.split("-")
+        return cls(int(count), float(min_radius), float(max_radius))
+
+
+DEFAULT_LESIONS = {
+    "primary": LesionSpec(2, 20, 35),
+    "lymph node": LesionSpec(40, 3, 8),
+    "carcinosis": LesionSpec(150, 2, 6),
+}
+
+
+def body_box(shape: tuple[int, int, int]) -> tuple[np.ndarray, np.ndarray]:
+    return (
+        (BODY_BOX[0] * shape).astype(int),
+        (BODY_BOX[1] * shape).astype(int),
+    )
+
+
+def region_masks(
+    shape: tuple[int, int, int] = SHAPE,
+) -> dict[QuadrantsInformation, CroppedMask]:
+    body_min, body_max = body_box(shape)
+    z_bands = np.linspace(body_min[2], body_max[2], 4).astype(int)
+    width = body_max[0] - body_min[0]
+
+    regions = {}
+    for region, band, x_start, x_end in REGION_LAYOUT:
+        box_min = np.array(
+            [body_min[0] + int(x_start * width), body_min[1], z_bands[band]]
+        )
+        box_max = np.array(
+            [body_min[0] + int(x_end * width), body_max[1], z_bands[band + 1]]
+        )
+        box_min = np.maximum(box_min - REGION_OVERLAP, 0)
+        box_max = np.minimum(box_max + REGION_OVERLAP, np.array(shape))
+        data = np.ones(tuple(box_max - box_min), dtype=bool)
+        regions[region] = CroppedMask(data, box_min, shape, SPACING, ORIGIN)
+
+    return regions
+
+
+def lesion_mask(
+    spec: LesionSpec,
+    rng: np.random.Generator,
+    shape: tuple[int, int, int] = SHAPE,
+    label_value: int = 1,
+) -> CroppedMask:
+    """`spec.count` ellipsoids with random center, axes and orientation."""
+    body_min, body_max = body_box(shape)
+    volume = np.zeros(shape, dtype=bool)
+    for _ in range(spec.count):
+        radius = rng.uniform(spec.min_radius, spec.max_radius)
+        axes = radius * rng.uniform(0.6, 1.0, 3)
+        rotation, _ = np.linalg.qr(rng.normal(size=(3, 3)))
+        center = rng.uniform(body_min, body_max)
+
+        reach = int(np.ceil(axes.max()))
+        lo = np.maximum(np.floor(center).astype(int) - reach, 0)
+        hi = np.minimum(np.floor(center).astype(int) + reach + 1, np.array(shape))
+        grid = np.stack(
+            np.meshgrid(*(np.arange(a, b) for a, b in zip(lo, hi)), indexing="ij"),
+            axis=-1,
+        )
+        local = (grid - center) @ rotation / axes
+        inside = np.einsum("...i,...i->...", local, local) <= 1.0
+        volume[tuple(slice(a, b) for a, b in zip(lo, hi))] |= inside
+
+    data, offset = crop_to_bbox(volume)
+    return CroppedMask(data, offset, shape, SPACING, ORIGIN, label_value=label_value)
+
+
+def disease_masks(
+    lesions: dict[str, LesionSpec] | None = None,
+    shape: tuple[int, int, int] = SHAPE,
+    seed: int = 0,
+) -> dict[str, tuple[int, CroppedMask]]:
+    """Same layout as SegmentationManager.get_cache_volume_dict."""
+    lesions = DEFAULT_LESIONS if lesions is None else lesions
+    rng = np.random.default_rng(seed)
+    return {
+        name: (label_value, lesion_mask(spec, rng, shape, label_value))
+        for label_value, (name, spec) in enumerate(lesions.items(), start=1)
+    }
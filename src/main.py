@@ -1,21 +1,61 @@
 import time
-from collections import namedtuple
-from collections.abc import MutableSequence
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
 from functools import wraps
 from pathlib import Path
 
+import click
 import numpy as np
 import vedo.vtkclasses as vtki
 from vedo import Light, Line, Mesh, Plotter, Text2D, Volume, colors
 
-from DiseaseClusterManager import DiseaseClusterManager
-from QuadrantInformation import (
-    QuadrantsInformation,
-    compute_center,
-    load_centers,
-    save_centers,
+from CroppedMask import PLANE_TO_AXIS, CroppedMask, plane_slice
+from DiseaseClusterManager import (
+    CLUSTERING_MODES,
+    DiseaseClusterManager,
+    load_region_mask,
 )
+from PatientFiles import DATASET_PATH, PatientFiles
+from QuadrantInformation import QuadrantsInformation
+from RegionGeometry import load_or_compute_geometries
+from RegionLookup import RegionLookup
+from ResliceSlice import ResliceSlice, label_colors, label_image, label_lookup_table
+from RuntimeCache import load_runtime_volume
 from SegmentationManager import SegmentationManager
+from SliceCompositor import CT_LEVEL, CT_WINDOW, CompositeSlice, composite_slice
+from SlicePrefetcher import SlicePrefetcher
+from SourceWatcher import SourceWatcher
+from VolumeSlice import VolumeSlice
+
+SEGMENT_DISPLAY_COLORS = {
+    "lymph node": "#9725e8",
+    "primary": "#45e825",
+    "carcinosis": "#f0e964",
+}
+
+## mesh: CT and segment slices as separate alpha blended meshes
+## composite (default): CT and segments blended in numpy into one RGBA image per
+## plane, the neighbouring images are prepared by the prefetcher while scrubbing
+## reslice: CT and packed labels resliced from the full volumes by the mapper,
+## window/level and label colors applied by the image properties
+SLICE_MODES = ("mesh", "composite", "reslice")
+OrthogonalSlice = VolumeSlice | CompositeSlice | ResliceSlice
+
+## Lesion navigation: 'n' jumps to the closest other lesion, 'l' lists the
+## largest lesions around the 3D camera focal point
+LARGEST_LESIONS_RADIUS_MM = 50.0
+LARGEST_LESIONS_COUNT = 5
+
+## Annotation files are polled while the viewer runs. Edits are reloaded and
+## only the affected clusters recomputed (see reload_annotations)
+ANNOTATION_POLL_MS = 2000
+
+## Left click (press and release within CLICK_TOLERANCE_PX) on a slice or on
+## the 3D view activates the region under the cursor
+CLICK_TOLERANCE_PX = 3
+
+VIEWPORT_TO_VIEW = {1: "coronal", 2: "sagittal", 3: "axial"}
+VIEW_TO_AX = {"coronal": "y", "sagittal": "x", "axial": "z"}
 
 
 def time_init(func):
@@ -30,6 +70,43 @@ def time_init(func):
     return wrapper
 
 
+def load_in_parallel(
+    tasks: dict[str, tuple[Callable, tuple]], max_workers: int
+) -> dict[str, object]:
+    """
+    Run the loading tasks {name: (function, args)} in a thread pool and print
+    the time of each one. Reading and gzip decoding release the GIL, so the
+    total time is bounded by the slowest file.
+    """
+
+    def timed(func, args):
+        start = time.time()
+        result = func(*args)
+        return result, time.time() - start
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            name: pool.submit(timed, func, args) for name, (func, args) in tasks.items()
+        }
+        results = {name: future.result() for name, future in futures.items()}
+
+    for name, (_, elapsed) in sorted(results.items(), key=lambda r: -r[1][1]):
+        print(f"  {name}: {elapsed:.3f} seconds")
+    print(
+        f"Loaded {len(tasks)} files in {time.time() - start:.3f} seconds "
+        f"({max_workers} workers)"
+    )
+
+    return {name: result for name, (result, _) in results.items()}
+
+
+def load_segmentation(seg_path: Path, runtime_path: Path) -> SegmentationManager:
+    segmentation_manager = SegmentationManager(seg_path, runtime_path=runtime_path)
+    segmentation_manager.load_volumes_to_cache(segmentation_manager.segment_names())
+    return segmentation_manager
+
+
 def is_int(s):
     try:
         int(s)
@@ -38,32 +115,34 @@ def is_int(s):
         return False
 
 
-def load_ct_scans_regions(
-    data_path: Path,
-) -> dict[QuadrantsInformation, Volume]:
-    regions_path = data_path / "regions"
-    regions_dict: dict[QuadrantsInformation, Volume] = {}
-    for region_file in regions_path.glob("*.seg.nrrd"):
-        quadrant_info = QuadrantsInformation.from_file_name(region_file)
-        regions_dict[quadrant_info] = Volume(region_file)
-
-        # print(f"Loaded {quadrant_info.name}")
-        # if quadrant_info == QuadrantsInformation.PELVIC_REGION:
-        #     break
-
-    return regions_dict
-
-
 class CT_Viewer(Plotter):
     @time_init
-    def __init__(self, enable_3d_view: bool = True):
+    def __init__(
+        self,
+        enable_3d_view: bool = True,
+        slice_mode: str = "composite",
+        load_workers: int = 4,
+        clustering_mode: str = "pairwise",
+        cluster_workers: int = 1,
+        dataset_path: Path = DATASET_PATH,
+        patient_id: int = 6,
+    ):
+        assert slice_mode in SLICE_MODES, f"slice_mode must be one of {SLICE_MODES}"
+        self.patient = PatientFiles.from_dataset(dataset_path, patient_id)
         self.enable_3d_view = enable_3d_view
+        self.slice_mode = slice_mode
+        self.load_workers = load_workers
+        self.clustering_mode = clustering_mode
+        self.cluster_workers = cluster_workers
 
         kwargs = {"sharecam": False, "size": (1200, 800)}
         kwargs.update({"bg": "black", "bg2": "black"})
 
         super().__init__(shape=(2, 4), title="CT Viewer", **kwargs)
         self.interactor.RemoveObservers("KeyPressEvent")  # type: ignore
+        ## Mouse wheel scrubs slices in viewports 1-3, see on_mouse_wheel
+        self.interactor.RemoveObservers("MouseWheelForwardEvent")  # type: ignore
+        self.interactor.RemoveObservers("MouseWheelBackwardEvent")  # type: ignore
         self.set_layout()
 
         ## State variables
@@ -75,15 +154,29 @@ class CT_Viewer(Plotter):
         self.segmentation_manager: SegmentationManager
 
         ## Vedo object containers
-        self.quadrant_volumes_dict: dict[QuadrantsInformation, Volume] = {}
+        self.quadrant_volumes_dict: dict[QuadrantsInformation, CroppedMask] = {}
         self.quadrant_slices_dict: dict[QuadrantsInformation, Mesh] = {}
         self.slices_region_viewer: list[Mesh] = []
         self.meshes_3d_viewer: list[Mesh | vtki.vtkLight] = []
-        self.slices_ortogonal_viewers: dict[str, list[Mesh]] = {}
+        ## Persistent actors of viewports 1-3, moved in place when the target
+        ## changes (see create_slice_actors)
+        self.slices_ortogonal_viewers: dict[str, list[OrthogonalSlice]] = {}
+        self.crosshairs: dict[str, list[Line]] = {}
+        self.slice_prefetcher: SlicePrefetcher[np.ndarray] | None = None
 
         self.setup_viewer()  # Initialize all containers
 
         self.add_callback("KeyPress", self.on_key_press)
+        self.add_callback("MouseWheelForward", lambda evt: self.on_mouse_wheel(evt, 1))
+        self.add_callback(
+            "MouseWheelBackward", lambda evt: self.on_mouse_wheel(evt, -1)
+        )
+        self.left_press_position: tuple[int, int] | None = None
+        self.add_callback("LeftButtonPress", self.on_left_button_press)
+        self.add_callback("LeftButtonRelease", self.on_left_button_release)
+        self.source_watcher = SourceWatcher([self.seg_path, *self.region_files])
+        self.add_callback("timer", self.on_timer, enable_picking=False)
+        self.timer_callback("start", dt=ANNOTATION_POLL_MS)
 
         self.update_slices_viewports(self.target_voxel)
         self.at(4).show(self.slices_region_viewer, camera=self.camera_params_regions)
@@ -157,41 +250,63 @@ class CT_Viewer(Plotter):
 
         return camera_params_slices
 
-    def update_slices_viewports(self, target_in_voxel):
+    def update_slices_viewports(self, target_in_voxel, reset_cameras: bool = True):
         """
-        Set viewports.at(1), at(2), at(3) to show orthogonal slices
+        Move the orthogonal slices of viewports 1, 2 and 3 and their
+        crosshairs to the target. Actors are updated in place.
         """
-        viewport_to_view = {1: "coronal", 2: "sagittal", 3: "axial"}
-        view_to_ax = {"coronal": "y", "sagittal": "x", "axial": "z"}
-
         ## Calculate target world
-        target_in_world = [0.0, 0.0, 0.0]
-        self.ct_volume.dataset.TransformContinuousIndexToPhysicalPoint(
-            target_in_voxel,
-            target_in_world,  # type: ignore
-        )
+        target_in_world = self.voxel_to_world(target_in_voxel)
         ## calculate camera params
         self.slices_camera_params = self.create_slices_cameras(target_in_world)
 
-        ## Remove old actors from each viewport
-        for i in range(1, 4):
-            self.at(i).remove(*self.slices_ortogonal_viewers[viewport_to_view[i]])
+        for plane_name, plane, index in orthogonal_planes(target_in_voxel):
+            self.update_plane_slices(plane_name, plane, index)
+        self.update_crosshairs(target_in_world)
 
-        ## Create new slices
-        self.slices_ortogonal_viewers = self.create_disease_slice(
-            self.ct_volume, target_in_voxel
-        )
+        if reset_cameras:
+            for i, view_name in VIEWPORT_TO_VIEW.items():
+                self.at(i).camera = self.slices_camera_params[view_name]
 
-        ## Add new objects to each viewport
-        for i, view_name in viewport_to_view.items():
-            this_view_objs = self.slices_ortogonal_viewers[viewport_to_view[i]]
-            crosshair = create_crosshair(
-                target_in_world, this_view_objs[0], view_to_ax[view_name]
+    def scrub_slice(self, viewport: int, step: int):
+        """
+        Move the slice of one orthogonal viewport by `step` voxels. Only that
+        slice is updated; the crosshairs of all three viewports follow the
+        target. Neighbouring slices are prefetched in the scroll direction.
+        """
+        view_name = VIEWPORT_TO_VIEW[viewport]
+        plane = VIEW_TO_AX[view_name]
+        axis = PLANE_TO_AXIS[plane]
+
+        n_slices = self.ct_volume.dimensions()[axis]
+        new_index = int(np.clip(self.target_voxel[axis] + step, 0, n_slices - 1))
+        if new_index == self.target_voxel[axis]:
+            return
+
+        self.target_voxel = list(self.target_voxel)
+        self.target_voxel[axis] = new_index
+        self.update_plane_slices(view_name, plane, new_index)
+        self.update_crosshairs(self.voxel_to_world(self.target_voxel))
+
+        if self.slice_prefetcher is not None:
+            self.slice_prefetcher.prefetch(plane, new_index, step)
+
+        self.render()
+
+    def update_crosshairs(self, target_in_world: list[float]):
+        for view_name, (hline, vline) in self.crosshairs.items():
+            slice_bounds = self.slices_ortogonal_viewers[view_name][0].bounds()
+            hline.vertices, vline.vertices = crosshair_endpoints(
+                target_in_world, slice_bounds, VIEW_TO_AX[view_name]
             )
-            self.slices_ortogonal_viewers[viewport_to_view[i]].extend(crosshair)
 
-            self.at(i).add(*self.slices_ortogonal_viewers[viewport_to_view[i]])
-            self.at(i).camera = self.slices_camera_params[view_name]
+    def voxel_to_world(self, voxel) -> list[float]:
+        target_in_world = [0.0, 0.0, 0.0]
+        self.ct_volume.dataset.TransformContinuousIndexToPhysicalPoint(
+            voxel,
+            target_in_world,  # type: ignore
+        )
+        return target_in_world
 
     def setup_text_labels(self):
         ## Static labels.
@@ -292,49 +407,70 @@ class CT_Viewer(Plotter):
             "Primary Tumor: Yes" if primary_present else "Primary Tumor: No"
         )
 
-    def load_volumes(self, data_path, patient_id):
-        ct_path = data_path / f"raw_scans_patient_{patient_id:02d}.nrrd"
-        ct = Volume(ct_path)
+    def load_volumes(self, patient: PatientFiles):
+        ## CT and segmentation are memory mapped from uncompressed copies in
+        ## patient.runtime_path. The first launch (or precompute.py) creates them.
+        ## All files are read concurrently (see load_in_parallel)
+        ct_path, seg_path = patient.ct_path, patient.seg_path
+        runtime_path, region_files = patient.runtime_path, patient.region_files
 
-        # seg = Volume(complete_path / "regions" / "pelvic_region_quadrant.seg.nrrd")
-        segmentation_manager = SegmentationManager(
-            data_path / "radiologist_annotations.seg.nrrd"
-        )
-        segmentation_manager.load_volumes_to_cache(
-            ["primary", "lymph node", "carcinosis"]
-        )
+        tasks: dict[str, tuple[Callable, tuple]] = {
+            ct_path.name: (load_runtime_volume, (ct_path, runtime_path)),
+            seg_path.name: (load_segmentation, (seg_path, runtime_path)),
+        }
+        for region_file in region_files:
+            tasks[region_file.name] = (load_region_mask, (region_file, runtime_path))
+
+        loaded = load_in_parallel(tasks, max_workers=self.load_workers)
 
-        region_seg_dict = load_ct_scans_regions(data_path)
+        ct = loaded[ct_path.name]
+        segmentation_manager = loaded[seg_path.name]
+        region_seg_dict = {
+            QuadrantsInformation.from_file_name(f): loaded[f.name] for f in region_files
+        }
+        self.seg_path, self.region_files = seg_path, region_files
 
         return ct, segmentation_manager, region_seg_dict
 
     def setup_viewer(self):
-        data_path = Path("/home/juan95/JuanData/OvarianCancerDataset/CT_scans")
-        patient_id = 6
-        data_path = data_path / f"Patient{patient_id:02d}/3d_slicer/"
-        runtime_path = data_path / "interface_runtime"
+        runtime_path = self.patient.runtime_path
+        self.runtime_path = runtime_path
 
         ## Viewports row 1: orthogonal slices view
         index = 270
+        self.region_slice_index = index
         self.ct_volume, self.segmentation_manager, self.quadrant_volumes_dict = (
-            self.load_volumes(data_path, patient_id)
+            self.load_volumes(self.patient)
         )
+        self.region_lookup = RegionLookup.from_regions(self.quadrant_volumes_dict)
         self.disease_cluster_manager = DiseaseClusterManager(
             regions_dict=self.quadrant_volumes_dict,
             disease_dict=self.segmentation_manager.get_cache_volume_dict(),
             root_path=runtime_path,
+            clustering_mode=self.clustering_mode,
+            workers=self.cluster_workers,
+            source_files=[self.seg_path, *self.region_files],
         )
 
+        self.set_segment_colors()
+
+        if self.slice_mode == "composite":
+            self.ct_array = self.ct_volume.tonumpy()
+            self.slice_prefetcher = SlicePrefetcher(
+                self.prepare_composited_slice,
+                n_slices=dict(zip("xyz", self.ct_volume.dimensions())),
+            )
+
         ### Create slices
         ct_slice = self.slice_intensity_volume(self.ct_volume, index=index)
         self.quadrant_slices_dict = self.create_quadrant_slices(index=index)
-        self.slices_ortogonal_viewers = self.create_disease_slice(
-            self.ct_volume, target_voxel=self.target_voxel
-        )
+        self.create_slice_actors()
 
         seg_slices_list = [s for s in self.quadrant_slices_dict.values()]
 
-        self.quadrant_center_dict = self.load_region_centers(runtime_path)
+        self.region_geometry = load_or_compute_geometries(
+            self.quadrant_volumes_dict, self.region_files, runtime_path
+        )
 
         ### Set active quadrant
         quadrant = QuadrantsInformation.from_id(self.active_quadrant_id)
@@ -356,6 +492,20 @@ class CT_Viewer(Plotter):
         seg_slices_list.append(ct_slice)
         self.slices_region_viewer = seg_slices_list
 
+    def set_segment_colors(self):
+        ## Segments without a display color use the color stored in the seg.nrrd
+        self.segment_colors = {
+            s.name: SEGMENT_DISPLAY_COLORS.get(s.name, s.hex_color)
+            for s in self.segmentation_manager.catalog
+        }
+
+        if self.slice_mode in ("composite", "reslice"):
+            self.segment_rgb = {
+                name: colors.get_color(c) for name, c in self.segment_colors.items()
+            }
+            # Build the packed labels now, prefetch threads only read them
+            self.segmentation_manager.get_packed_labels()
+
     def setup_3d_viewer(self) -> list[Mesh | vtki.vtkLight]:
         ## TODO: all the functionality of the 3D viewer should be moved to its own class
         ## Viewport row2 - region viewport and 3D rendering window
@@ -406,39 +556,110 @@ class CT_Viewer(Plotter):
 
         return ct_slice
 
-    def create_disease_slice(
-        self, ct_volume: Volume, target_voxel: list[int]
-    ) -> dict[str, list[Mesh]]:
-        slices_dict: dict[str, list[Mesh]] = {}
-
-        SegmentInfo = namedtuple("Segment", ["name", "color"])
-        lymph_segment = SegmentInfo("lymph node", "#9725e8")
-        primary_segment = SegmentInfo("primary", "#45e825")
-        carcinosis_segment = SegmentInfo("carcinosis", "#f0e964")
-
-        all_segments = (lymph_segment, primary_segment, carcinosis_segment)
-        orthogonal_planes = (
-            ("sagittal", "x", target_voxel[0]),
-            ("coronal", "y", target_voxel[1]),
-            ("axial", "z", target_voxel[2]),
-        )
-        for plane_name, plane, index in orthogonal_planes:
-            slices_dict[plane_name] = []
-            ct_slice = self.slice_intensity_volume(ct_volume, index=index, plane=plane)
-            slices_dict[plane_name].append(ct_slice)
-
-            for segment in all_segments:
-                segment_slice = self.segmentation_manager.get_slice(
-                    segment.name, index, plane=plane, color=segment.color
+    def create_slice_actors(self):
+        """
+        Slice and crosshair actors of viewports 1-3, added once and then moved
+        by update_slices_viewports and scrub_slice. Called again when the
+        segmentation is reloaded, to replace the segment slices.
+        """
+        ## Each segment image is shared by the slices of the three planes
+        segment_volumes = {}
+        if self.slice_mode == "mesh":
+            for segment_name in self.segment_colors:
+                mask = self.segmentation_manager.get_mask_from_segment_name(
+                    segment_name
                 )
-                slices_dict[plane_name].append(segment_slice)
+                if not mask.empty:
+                    segment_volumes[segment_name] = (mask.to_volume(), mask.offset)
+
+        ## The label image and lookup table are shared by the three planes
+        if self.slice_mode == "reslice":
+            packed_labels = self.segmentation_manager.get_packed_labels()
+            self.label_image = label_image(packed_labels)
+            self.label_lut = label_lookup_table(
+                label_colors(packed_labels, self.segment_rgb)
+            )
 
-        return slices_dict
+        for i, view_name in VIEWPORT_TO_VIEW.items():
+            if view_name in self.slices_ortogonal_viewers:
+                self.at(i).remove(
+                    *self.slices_ortogonal_viewers[view_name],
+                    *self.crosshairs[view_name],
+                )
+
+            plane = VIEW_TO_AX[view_name]
+            self.slices_ortogonal_viewers[view_name] = self.create_plane_slices(
+                self.ct_volume, plane, segment_volumes
+            )
+            self.crosshairs[view_name] = create_crosshair()
+            self.at(i).add(
+                *self.slices_ortogonal_viewers[view_name], *self.crosshairs[view_name]
+            )
+
+    def create_plane_slices(
+        self, ct_volume: Volume, plane: str, segment_volumes: dict
+    ) -> list[OrthogonalSlice]:
+        """
+        CT and segment slices of one plane. The CT slice is always first.
+        `segment_volumes` maps segment names to (vedo Volume, offset) of the
+        segments bounding boxes.
+        """
+        if self.slice_mode == "composite":
+            return [CompositeSlice(ct_volume.spacing(), ct_volume.origin())]
+        if self.slice_mode == "reslice":
+            return [
+                ResliceSlice(ct_volume.dataset, self.label_image, self.label_lut, plane)
+            ]
+
+        plane_slices: list[OrthogonalSlice] = []
+        ct_slice = VolumeSlice(ct_volume.dataset, plane)
+        ct_slice.mesh.cmap(
+            "gray", vmin=CT_LEVEL - CT_WINDOW / 2, vmax=CT_LEVEL + CT_WINDOW / 2
+        )
+        plane_slices.append(ct_slice)
+
+        for segment_name, (volume, offset) in segment_volumes.items():
+            segment_slice = VolumeSlice(volume.dataset, plane, offset)
+            color = self.segment_colors[segment_name]
+            segment_slice.mesh.cmap(
+                self.segmentation_manager.get_lut(segment_name, color)
+            )
+            segment_slice.mesh.alpha(0.3)
+            plane_slices.append(segment_slice)
+
+        return plane_slices
+
+    def update_plane_slices(self, view_name: str, plane: str, index: int):
+        """Move the slices of one plane to `index`, clipped to the CT."""
+        n_slices = self.ct_volume.dimensions()[PLANE_TO_AXIS[plane]]
+        index = int(np.clip(index, 0, n_slices - 1))
+        plane_slices = self.slices_ortogonal_viewers[view_name]
+        if self.slice_mode == "composite":
+            assert self.slice_prefetcher is not None
+            rgba = self.slice_prefetcher.get(plane, index)
+            plane_slices[0].update(rgba, plane, index)  # type: ignore
+            return
+        if self.slice_mode == "reslice":
+            plane_slices[0].update(index)  # type: ignore
+            return
+
+        for orthogonal_slice in plane_slices:
+            orthogonal_slice.update(index)  # type: ignore
+
+    def prepare_composited_slice(self, plane: str, index: int) -> np.ndarray:
+        """Numpy only, runs in the prefetch threads."""
+        ct_slice = plane_slice(self.ct_array, plane, index)
+        segment_masks = self.segmentation_manager.get_slice_masks(plane, index)
+        return composite_slice(ct_slice, segment_masks, self.segment_rgb)
 
     def create_quadrant_slices(self, index) -> dict[QuadrantsInformation, Mesh]:
         slices_dict = {}
         for region, volume in self.quadrant_volumes_dict.items():
             seg_slice = volume.yslice(index)
+            slices_dict[region] = seg_slice
+            if seg_slice.npoints == 0:  # slice outside of the region bounding box
+                continue
+
             lut = colors.build_lut(
                 [
                     (0, (0, 0, 0), 0.0),  # background (scalar, color, alpha)
@@ -452,25 +673,8 @@ class CT_Viewer(Plotter):
             seg_slice.cmap(lut)
             seg_slice.alpha(0.0)
 
-            slices_dict[region] = seg_slice
-
         return slices_dict
 
-    def load_region_centers(
-        self, runtime_path
-    ) -> dict[QuadrantsInformation, np.ndarray]:
-        centers_dict = {}
-
-        try:
-            centers_dict = load_centers(runtime_path)
-        except FileNotFoundError:
-            print("Centers file not found. Computing region centers...")
-            for region, volume in self.quadrant_volumes_dict.items():
-                centers_dict[region] = compute_center(volume)
-            save_centers(centers_dict, runtime_path)
-
-        return centers_dict
-
     def on_key_press(self, evt):
         """Handle keyboard events"""
         key = evt.keypress
@@ -484,32 +688,183 @@ class CT_Viewer(Plotter):
             print("focal", self.at(4).camera.GetFocalPoint())  # type: ignore
             print("viewup", self.at(4).camera.GetViewUp())  # type: ignore
 
+        elif key == "n":
+            self.jump_to_nearest_lesion()
+
+        elif key == "l":
+            self.print_largest_lesions_near_focal_point()
+
+        elif key in ("Up", "Down") and evt.at in VIEWPORT_TO_VIEW:
+            self.scrub_slice(evt.at, 1 if key == "Up" else -1)
+
         elif is_int(key):
             idx = int(key)
             if idx < 7 and idx >= 0:
-                ## Adapt region view port
-                # print(f"activating {QuadrantsInformation.from_id(idx).name}")
-                current_quadrant = QuadrantsInformation.from_id(self.active_quadrant_id)
-                self.quadrant_slices_dict[current_quadrant].alpha(0.0)
+                self.set_active_quadrant(QuadrantsInformation.from_id(idx))
 
-                new_quadrant = QuadrantsInformation.from_id(idx)
-                self.quadrant_slices_dict[new_quadrant].alpha(0.4)
-                self.active_quadrant_id = idx
+            self.render()
 
-                self.station_text = "Region: " + new_quadrant.name
-                self.station_text_vedo.text(self.station_text)
+    def set_active_quadrant(
+        self, new_quadrant: QuadrantsInformation, target_voxel: list[int] | None = None
+    ):
+        """
+        Highlight the region and move the 3D camera and the slices to it. The
+        slices are centered on `target_voxel`, by default the largest lesion of
+        the region (see calculate_new_target).
+        """
+        ## Adapt region view port
+        current_quadrant = QuadrantsInformation.from_id(self.active_quadrant_id)
+        self.quadrant_slices_dict[current_quadrant].alpha(0.0)
+        self.quadrant_slices_dict[new_quadrant].alpha(0.4)
+        self.active_quadrant_id = new_quadrant.id
 
-                ## Adapt 3D view port
-                self.position_3d_camera_in_region(new_quadrant)
+        self.station_text = "Region: " + new_quadrant.name
+        self.station_text_vedo.text(self.station_text)
 
-                ## Adapt slices view port
-                self.target_voxel = self.calculate_new_target(new_quadrant)
-                # print(f"New target voxel {self.target_voxel}")
-                self.update_slices_viewports(self.target_voxel)
+        ## Adapt 3D view port
+        self.position_3d_camera_in_region(new_quadrant)
 
-                self.update_disease_text_labels(new_quadrant)
+        ## Adapt slices view port
+        if target_voxel is None:
+            target_voxel = self.calculate_new_target(new_quadrant)
+        self.target_voxel = target_voxel
+        self.update_slices_viewports(self.target_voxel)
 
-            self.render()
+        self.update_disease_text_labels(new_quadrant)
+
+    def on_left_button_press(self, evt):
+        self.left_press_position = evt.picked2d
+
+    def on_left_button_release(self, evt):
+        """
+        A click (not a camera drag) activates the region under the cursor.
+        Clicks on a slice also center the slices on the clicked voxel.
+        """
+        press_position, self.left_press_position = self.left_press_position, None
+        if press_position is None or evt.picked3d is None:
+            return
+        if np.abs(np.subtract(evt.picked2d, press_position)).max() > CLICK_TOLERANCE_PX:
+            return
+
+        region = self.region_lookup.region_at_world(evt.picked3d)
+        if region is None:
+            print("Clicked outside of the regions")
+            return
+
+        target_voxel = None
+        if evt.at in VIEWPORT_TO_VIEW:
+            voxel = self.region_lookup.world_to_voxel(evt.picked3d)
+            target_voxel = np.clip(voxel, 0, np.array(self.ct_volume.dimensions()) - 1)
+            target_voxel = target_voxel.tolist()
+        self.set_active_quadrant(region, target_voxel)
+        self.render()
+
+    def jump_to_nearest_lesion(self):
+        """Center the orthogonal slices on the closest lesion to the target."""
+        cluster_index = self.disease_cluster_manager.get_cluster_index()
+        ## The target is rounded to a voxel: skip lesions within one voxel of it
+        hit = cluster_index.nearest(
+            cluster_index.voxel_to_world(self.target_voxel),
+            min_distance_mm=float(np.linalg.norm(cluster_index.spacing)),
+        )
+        if hit is None:
+            print("No other lesion found")
+            return
+
+        print(
+            f"Nearest lesion: {hit.disease} in {hit.region.name}, "
+            f"{hit.distance_mm:.1f} mm away"
+        )
+        self.target_voxel = np.rint(hit.centroid_vox).astype(int).tolist()
+        self.update_slices_viewports(self.target_voxel)
+        self.render()
+
+    def print_largest_lesions_near_focal_point(self):
+        focal_point = self.at(5).camera.GetFocalPoint()  # type: ignore
+        hits = self.disease_cluster_manager.get_cluster_index().largest_near(
+            focal_point, LARGEST_LESIONS_COUNT, LARGEST_LESIONS_RADIUS_MM
+        )
+        print(
+            f"Largest lesions within {LARGEST_LESIONS_RADIUS_MM:.0f} mm of the camera:"
+        )
+        for hit in hits:
+            print(
+                f"  {hit.disease} in {hit.region.name}: {hit.voxel_count} voxels, "
+                f"{hit.distance_mm:.1f} mm"
+            )
+
+    def on_timer(self, evt):
+        changed = self.source_watcher.poll()
+        if changed:
+            self.reload_annotations(changed)
+
+    def reload_annotations(self, changed_files: list[Path]):
+        """
+        Swap in edited annotation files without restarting: reload them,
+        recompute the clusters of the changed masks only and redraw the slices.
+        """
+        start = time.time()
+        disease_dict = None
+        if self.seg_path in changed_files:
+            segmentation_manager = load_segmentation(self.seg_path, self.runtime_path)
+            if self.slice_prefetcher is not None:
+                self.slice_prefetcher.clear()
+            self.segmentation_manager = segmentation_manager
+            self.set_segment_colors()
+            self.create_slice_actors()
+            disease_dict = self.segmentation_manager.get_cache_volume_dict()
+
+        regions_dict = {
+            QuadrantsInformation.from_file_name(f): load_region_mask(
+                f, self.runtime_path
+            )
+            for f in changed_files
+            if f in self.region_files
+        }
+        ## The manager diffs the reloaded masks against its previous ones
+        pairs = self.disease_cluster_manager.update_inputs(regions_dict, disease_dict)
+        self.quadrant_volumes_dict.update(regions_dict)
+        print(
+            f"Reloaded {', '.join(f.name for f in changed_files)}: "
+            f"{len(pairs)} cluster pairs recalculated in {time.time() - start:.2f} s"
+        )
+
+        if regions_dict:
+            self.region_lookup = RegionLookup.from_regions(self.quadrant_volumes_dict)
+            self.region_geometry = load_or_compute_geometries(
+                self.quadrant_volumes_dict, self.region_files, self.runtime_path
+            )
+            self.at(4).remove(*self.quadrant_slices_dict.values())
+            self.quadrant_slices_dict = self.create_quadrant_slices(
+                index=self.region_slice_index
+            )
+            active = QuadrantsInformation.from_id(self.active_quadrant_id)
+            self.quadrant_slices_dict[active].alpha(0.4)
+            self.at(4).add(*self.quadrant_slices_dict.values())
+            ct_slice = self.slices_region_viewer[-1]
+            self.slices_region_viewer = [*self.quadrant_slices_dict.values(), ct_slice]
+
+        self.update_slices_viewports(self.target_voxel, reset_cameras=False)
+        self.update_disease_text_labels(
+            QuadrantsInformation.from_id(self.active_quadrant_id)
+        )
+        self.render()
+
+    def on_mouse_wheel(self, evt, step: int):
+        """Scrub slices in viewports 1-3, zoom in the other viewports."""
+        if evt.at in VIEWPORT_TO_VIEW:
+            self.scrub_slice(evt.at, step)
+            return
+
+        renderer = self.renderers[evt.at]
+        renderer.GetActiveCamera().Dolly(1.1 if step > 0 else 1 / 1.1)
+        renderer.ResetCameraClippingRange()
+        self.render()
+
+    def close(self):
+        if self.slice_prefetcher is not None:
+            self.slice_prefetcher.shutdown()
+        return super().close()
 
     def calculate_new_target(self, new_quadrant: QuadrantsInformation) -> list[int]:
         disease_to_highlight = ["lymph node", "primary", "carcinosis"]
@@ -522,45 +877,32 @@ class CT_Viewer(Plotter):
 
         # If no annotations are found use region center
         print(f"no disease detected in {new_quadrant.name}, using region center")
-        vol_center = self.quadrant_center_dict[new_quadrant]
-        vol_center[1] = 264  # TODO: fix hardcoded value
-        target_voxel = vol_center.tolist()
+        target = self.region_geometry[new_quadrant].center_vox.copy()
+        target[1] = 264  # TODO: fix hardcoded value
+        target_voxel = target.tolist()
 
         return target_voxel
 
     def position_3d_camera_in_region(self, new_quadrant: QuadrantsInformation):
         """
-        Change 3D camera position
-        index 0 --> Left-right
-        index 1 --> Anterior-posterior
-        index 2 --> inferior-superior
+        Look at the anterior plane center of the region from the front of the
+        grid. Positions are precomputed, see RegionGeometry.
         """
-
-        volume = self.quadrant_volumes_dict[new_quadrant]
-        vol_center = self.quadrant_center_dict[new_quadrant]
-
-        anterior_plane_center = vol_center
-        anterior_plane_center[1] = int(volume.shape[1])
-
-        center_in_world: MutableSequence[float]
-        center_in_world = [0, 0, 0]
-        volume.dataset.TransformContinuousIndexToPhysicalPoint(
-            anterior_plane_center,  # type: ignore
-            center_in_world,
-        )
-        center_in_world_np = np.array(center_in_world)
-
-        # New camera position
-        new_cam_pos1 = center_in_world_np.copy()
-        vol_bounds = volume.bounds()
-        new_cam_pos1[1] = vol_bounds[2] - 200
-
-        self.at(5).camera.SetPosition(new_cam_pos1)  # type: ignore
-        self.at(5).camera.SetFocalPoint(center_in_world)  # type: ignore
+        geometry = self.region_geometry[new_quadrant]
+        self.at(5).camera.SetPosition(geometry.camera_position_world)  # type: ignore
+        self.at(5).camera.SetFocalPoint(geometry.anterior_center_world)  # type: ignore
         self.at(5).camera.SetViewUp([0, 0, 1])  # type: ignore
         self.at(5).renderer.ResetCameraClippingRange()  # type: ignore
 
 
+def orthogonal_planes(target_voxel) -> tuple[tuple[str, str, int], ...]:
+    return (
+        ("sagittal", "x", target_voxel[0]),
+        ("coronal", "y", target_voxel[1]),
+        ("axial", "z", target_voxel[2]),
+    )
+
+
 def camera_params_3d_viewer_init(vol_center, vol_bounds):
     # Bounding box --> [xmin,xmax, ymin,ymax, zmin,zmax].
     slice_focal_point = [vol_center[0], vol_center[1], vol_center[2]]
@@ -639,40 +981,46 @@ def load_meshes(
     return meshes_list, meshes_dict
 
 
-def create_crosshair(
-    target_in_world: list[float], slice_mesh: Mesh, plane: str, size: float = 0.02
+def create_crosshair() -> list[Line]:
+    """Two yellow lines, placed by crosshair_endpoints."""
+    return [Line((0, 0, 0), (1, 0, 0), c="yellow", lw=2) for _ in range(2)]
+
+
+def crosshair_endpoints(
+    target_in_world: list[float], slice_bounds, plane: str, size: float = 0.02
 ):
     """
+    Endpoints of the horizontal and vertical crosshair lines.
     target: (x,y,z) in world coords
-    slice_mesh: vedo.Mesh of the slice (to get bounds)
+    slice_bounds: bounds of the slice, the lines are `size` times its extent
     plane: 'x', 'y', or 'z' – which axis is constant for this slice
     """
-    x0, x1, y0, y1, z0, z1 = slice_mesh.bounds()
+    x0, x1, y0, y1, z0, z1 = slice_bounds
 
     cx, cy, cz = target_in_world
 
     if plane == "z":  # axial -> lines in X,Y
         dx = (x1 - x0) * size
         dy = (y1 - y0) * size
-        hline = Line((cx - dx, cy, cz), (cx + dx, cy, cz), c="yellow", lw=2)
-        vline = Line((cx, cy - dy, cz), (cx, cy + dy, cz), c="yellow", lw=2)
+        hline = [(cx - dx, cy, cz), (cx + dx, cy, cz)]
+        vline = [(cx, cy - dy, cz), (cx, cy + dy, cz)]
 
     elif plane == "y":  # coronal -> lines in X,Z
         dx = (x1 - x0) * size
         dz = (z1 - z0) * size
-        hline = Line((cx - dx, cy, cz), (cx + dx, cy, cz), c="yellow", lw=2)
-        vline = Line((cx, cy, cz - dz), (cx, cy, cz + dz), c="yellow", lw=2)
+        hline = [(cx - dx, cy, cz), (cx + dx, cy, cz)]
+        vline = [(cx, cy, cz - dz), (cx, cy, cz + dz)]
 
     elif plane == "x":  # sagittal -> lines in Y,Z
         dy = (y1 - y0) * size
         dz = (z1 - z0) * size
-        hline = Line((cx, cy - dy, cz), (cx, cy + dy, cz), c="yellow", lw=2)
-        vline = Line((cx, cy, cz - dz), (cx, cy, cz + dz), c="yellow", lw=2)
+        hline = [(cx, cy - dy, cz), (cx, cy + dy, cz)]
+        vline = [(cx, cy, cz - dz), (cx, cy, cz + dz)]
 
     else:
         raise ValueError("plane must be 'x', 'y' or 'z'")
 
-    return [hline, vline]
+    return hline, vline
 
 
 def create_lights(vol_center, vol_bounds):
@@ -705,8 +1053,61 @@ def set_disease_visual_properties(mesh_dict):
         mesh.properties.SetSpecularPower(14)
 
 
-def main():
-    viewer = CT_Viewer()
+@click.command()
+@click.option(
+    "--dataset-path",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default=DATASET_PATH,
+    show_default=True,
+    help="Folder with the PatientXX/3d_slicer folders.",
+)
+@click.option("--patient-id", type=int, default=6, show_default=True)
+@click.option(
+    "--slice-mode",
+    type=click.Choice(SLICE_MODES),
+    default="composite",
+    show_default=True,
+    help="How the orthogonal slices are rendered. Only composite prefetches "
+    "the neighbouring slices while scrubbing.",
+)
+@click.option(
+    "--load-workers",
+    type=int,
+    default=4,
+    show_default=True,
+    help="Number of threads used to load the CT, segmentation and regions.",
+)
+@click.option(
+    "--clustering-mode",
+    type=click.Choice(CLUSTERING_MODES),
+    default="pairwise",
+    show_default=True,
+    help="pairwise: clusters per (region, disease) pair. "
+    "region_map: lesions labeled once and split by region.",
+)
+@click.option(
+    "--cluster-workers",
+    type=int,
+    default=1,
+    show_default=True,
+    help="Processes used to compute the disease clusters of a new patient.",
+)
+def main(
+    dataset_path: Path,
+    patient_id: int,
+    slice_mode: str,
+    load_workers: int,
+    clustering_mode: str,
+    cluster_workers: int,
+):
+    viewer = CT_Viewer(
+        slice_mode=slice_mode,
+        load_workers=load_workers,
+        clustering_mode=clustering_mode,
+        cluster_workers=cluster_workers,
+        dataset_path=dataset_path,
+        patient_id=patient_id,
+    )
     viewer.interactive().close()
 
 
@@ -0,0 +1,181 @@
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from pathlib import Path
+
+import click
+
+from DiseaseClusterManager import (
+    CLUSTERING_MODES,
+    DiseaseClusterManager,
+    clusters_up_to_date,
+    load_region_mask,
+    region_mask_up_to_date,
+)
+from PatientFiles import DATASET_PATH, PatientFiles, find_patients
+from QuadrantInformation import QuadrantsInformation
+from RegionGeometry import geometries_up_to_date, load_or_compute_geometries
+from RuntimeCache import convert_nrrd_to_runtime, is_runtime_up_to_date
+from SegmentationManager import SegmentationManager
+from SegmentCatalog import catalog_up_to_date
+from SharedMaskPool import process_context
+
+
+@dataclass(frozen=True)
+class PrecomputeResult:
+    patient_id: int
+    seconds: float
+    input_bytes: int  # size of the nrrd files of the patient
+
+
+def input_files(patient: PatientFiles) -> list[Path]:
+    return [patient.ct_path, patient.seg_path, *patient.region_files]
+
+
+def patient_up_to_date(patient: PatientFiles, clustering_modes: list[str]) -> bool:
+    """Stat only check of every runtime cache the viewer reads at launch."""
+    runtime_path = patient.runtime_path
+    cluster_sources = [patient.seg_path, *patient.region_files]
+    return (
+        is_runtime_up_to_date(patient.ct_path, runtime_path)
+        and is_runtime_up_to_date(patient.seg_path, runtime_path)
+        and all(region_mask_up_to_date(f, runtime_path) for f in patient.region_files)
+        and catalog_up_to_date(patient.seg_path, runtime_path)
+        and geometries_up_to_date(patient.region_files, runtime_path)
+        and all(
+            clusters_up_to_date(runtime_path, cluster_sources, mode)
+            for mode in clustering_modes
+        )
+    )
+
+
+def precompute_patient(
+    patient: PatientFiles, clustering_modes: list[str]
+) -> PrecomputeResult:
+    """
+    Build the runtime caches of one patient: uncompressed copies of the CT and
+    segmentation, cropped region masks, segment catalog, region geometry and
+    clusters. Caches that are up to date are kept.
+    """
+    start = time.time()
+    runtime_path = patient.runtime_path
+    if not is_runtime_up_to_date(patient.ct_path, runtime_path):
+        convert_nrrd_to_runtime(patient.ct_path, runtime_path)
+
+    segmentation_manager = SegmentationManager(
+        patient.seg_path, runtime_path=runtime_path
+    )
+    segmentation_manager.load_volumes_to_cache(segmentation_manager.segment_names())
+    regions_dict = {
+        QuadrantsInformation.from_file_name(f): load_region_mask(f, runtime_path)
+        for f in patient.region_files
+    }
+    load_or_compute_geometries(regions_dict, patient.region_files, runtime_path)
+
+    for clustering_mode in clustering_modes:
+        DiseaseClusterManager(
+            root_path=runtime_path,
+            regions_dict=regions_dict,
+            disease_dict=segmentation_manager.get_cache_volume_dict(),
+            clustering_mode=clustering_mode,
+            source_files=[patient.seg_path, *patient.region_files],
+        )
+
+    return PrecomputeResult(
+        patient.patient_id,
+        time.time() - start,
+        sum(f.stat().st_size for f in input_files(patient)),
+    )
+
+
+@click.command()
+@click.option(
+    "--dataset-path",
+    type=click.Path(exists=True, file_okay=False, path_type=Path),
+    default=DATASET_PATH,
+    show_default=True,
+    help="Folder with the PatientXX/3d_slicer folders.",
+)
+@click.option(
+    "--patient-id",
+    "patient_ids",
+    type=int,
+    multiple=True,
+    help="Only precompute these patients (repeatable). Default: all.",
+)
+@click.option(
+    "--clustering-mode",
+    "clustering_modes",
+    type=click.Choice(CLUSTERING_MODES),
+    multiple=True,
+    default=("pairwise",),
+    show_default=True,
+    help="Cluster stores to build (repeatable).",
+)
+@click.option(
+    "--workers",
+    type=int,
+    default=min(4, os.cpu_count() or 1),
+    show_default=True,
+    help="Patients processed in parallel.",
+)
+def main(
+    dataset_path: Path,
+    patient_ids: tuple[int, ...],
+    clustering_modes: tuple[str, ...],
+    workers: int,
+):
+    """Build the interface_runtime caches of all patients, without the viewer."""
+    start = time.time()
+    patients = find_patients(dataset_path)
+    if patient_ids:
+        patients = [p for p in patients if p.patient_id in patient_ids]
+
+    modes = list(clustering_modes)
+    pending = [p for p in patients if not patient_up_to_date(p, modes)]
+    print(
+        f"{len(patients)} patients found, {len(patients) - len(pending)} up to date, "
+        f"{len(pending)} to precompute ({workers} workers)"
+    )
+
+    results: list[PrecomputeResult] = []
+    failed: list[int] = []
+    if pending:
+        with ProcessPoolExecutor(
+            max_workers=min(workers, len(pending)), mp_context=process_context()
+        ) as executor:
+            futures = {
+                executor.submit(precompute_patient, patient, modes): patient
+                for patient in pending
+            }
+            for future in as_completed(futures):
+                patient_id = futures[future].patient_id
+                try:
+                    result = future.result()
+                except Exception as e:
+                    print(f"Patient{patient_id:02d} failed: {e!r}")
+                    failed.append(patient_id)
+                    continue
+                results.append(result)
+                print(f"Patient{patient_id:02d} done in {result.seconds:.1f} seconds")
+
+    ## Throughput summary
+    elapsed = time.time() - start
+    input_mb = sum(r.input_bytes for r in results) / 1e6
+    print(
+        f"Precomputed {len(results)} patients in {elapsed:.1f} seconds "
+        f"({len(patients) - len(pending)} skipped, {len(failed)} failed)"
+    )
+    if results:
+        print(
+            f"  {len(results) / elapsed * 60:.1f} patients/min, "
+            f"{input_mb / elapsed:.1f} MB/s of nrrd input, "
+            f"{sum(r.seconds for r in results) / len(results):.1f} seconds per patient"
+        )
+    if failed:
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()